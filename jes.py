@@ -1,23 +1,27 @@
 #!/usr/bin/env python
 
+import argparse
+import time
+
+import pygame
+
+from jes_checkpoint import read_checkpoint
 from jes_sim import Simulation
 from jes_ui import UI
+from utils import dist_to_text
 
 
-def main() -> None:
-    creature_count = int(
-        input(
-            """
-How many creatures do you want?
-100: Lightweight
-250: Standard (if you don't type anything, I'll go with this)
-500: Strenuous (this is what my carykh video used)
-"""
-        )
-        or "250"
-    )
-
-    sim = Simulation(
+def create_simulation(
+    creature_count,
+    worker_count=1,
+    calm_tolerance=None,
+    checkpoint_path=None,
+    checkpoint_every=10,
+    trajectory_slots=0,
+    fitness_cache_size=None,
+    seed=None,
+):
+    return Simulation(
         creature_count=creature_count,
         stabilization_time=200,
         trial_time=300,
@@ -37,6 +41,34 @@ How many creatures do you want?
         mutation_rate=0.07,
         big_mutation_rate=0.025,
         units_per_meter=0.05,
+        worker_count=worker_count,  # >1 evaluates the population on that many processes
+        calm_tolerance=calm_tolerance,  # e.g. 1e-8 ends calming early for settled creatures
+        fitness_cache_size=fitness_cache_size,  # 0 turns the cache off
+        checkpoint_path=checkpoint_path,
+        checkpoint_every=checkpoint_every,
+        trajectory_slots=trajectory_slots,  # recorded trials for movies to replay
+        seed=seed,
+    )
+
+
+def run_interactive(args) -> None:
+    checkpoint = None
+    if args.resume is not None:
+        checkpoint = read_checkpoint(args.resume)
+        creature_count = int(checkpoint["creature_count"])
+    else:
+        creature_count = int(input("""
+How many creatures do you want?
+100: Lightweight
+250: Standard (if you don't type anything, I'll go with this)
+500: Strenuous (this is what my carykh video used)
+""") or "250")
+
+    sim = create_simulation(
+        creature_count,
+        checkpoint_path=args.checkpoint,
+        checkpoint_every=args.checkpoint_every,
+        trajectory_slots=512,
     )
 
     ui = UI(
@@ -57,15 +89,138 @@ How many creatures do you want?
     ui.sim = sim
     ui.add_buttons_and_sliders()
 
-    sim.initialize_universe()
+    if checkpoint is not None:
+        sim.resume_universe(checkpoint)
+    else:
+        sim.initialize_universe()
+    # Generations run on a background thread, which only gets the lock
+    # between frames; sleeping off the rest of each frame lets it take it.
+    clock = pygame.time.Clock()
     while ui.running:
-        sim.check_alap()
-        ui.detect_mouse_motion()
-        ui.detect_events()
-        ui.detect_sliders()
-        ui.do_movies()
-        ui.draw_menu()
-        ui.show()
+        with sim.lock:
+            sim.check_alap()
+            ui.detect_mouse_motion()
+            ui.detect_events()
+            ui.detect_sliders()
+            ui.do_movies()
+            ui.draw_menu()
+            ui.show()
+        clock.tick(60)
+    sim.close()
+
+
+def run_headless(args) -> None:
+    # No UI is attached, so no icons, mosaics or graphs are ever drawn and
+    # pygame never opens a window.
+    checkpoint = None
+    creature_count = args.creatures
+    if args.resume is not None:
+        checkpoint = read_checkpoint(args.resume)
+        creature_count = int(checkpoint["creature_count"])
+    sim = create_simulation(
+        creature_count,
+        args.workers,
+        args.calm_tolerance,
+        args.checkpoint,
+        args.checkpoint_every,
+        seed=args.seed,
+    )
+    try:
+        if checkpoint is not None:
+            sim.resume_universe(checkpoint)
+        else:
+            sim.initialize_universe()
+        start_time = time.monotonic()
+        for i in range(1, args.generations + 1):
+            sim.simulate_generation(None)
+            gen = sim.population.generation_count - 1
+            if i % args.report_every == 0 or i == args.generations:
+                best, median, worst = sim.percentiles[-1][
+                    [0, sim.percentile_base // 2, sim.percentile_base]
+                ]
+                rate = i / (time.monotonic() - start_time)
+                print(
+                    f"Generation {gen - 1}: "
+                    f"best {dist_to_text(best, True, sim.units_per_meter)}, "
+                    f"median {dist_to_text(median, True, sim.units_per_meter)}, "
+                    f"worst {dist_to_text(worst, True, sim.units_per_meter)} "
+                    f"({rate:.3f} generations/s)"
+                )
+                print(f"  {sim.get_stage_report(gen - 1)}")
+        elapsed = time.monotonic() - start_time
+    except BaseException:
+        sim.close(save=False)
+        raise
+    sim.close()
+    print(
+        f"Evolved {creature_count} creatures for {args.generations} generations "
+        f"in {elapsed:.1f}s ({args.generations / elapsed:.3f} generations/s)"
+    )
+    if sim.fitness_cache is not None:
+        print(f"Fitness cache hit rate: {sim.fitness_cache.get_hit_rate():.1%}")
+
+
+def positive_int(text):
+    value = int(text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"{text} is not a positive integer")
+    return value
+
+
+def creature_count(text):
+    value = positive_int(text)
+    if value % 2 != 0:
+        # creatures are bred in pairs, the i-th best with the i-th worst
+        raise argparse.ArgumentTypeError(f"{text} is not an even number")
+    return value
+
+
+def add_checkpoint_arguments(parser):
+    parser.add_argument(
+        "--checkpoint", default=None, help="file to save the run to as it goes"
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=positive_int,
+        default=10,
+        help="generations between checkpoints",
+    )
+    parser.add_argument(
+        "--resume", default=None, help="checkpoint file to pick a run back up from"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Jelly Evolution Simulator")
+    add_checkpoint_arguments(parser)
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser(
+        "run", help="evolve without a window and report generations per second"
+    )
+    run_parser.add_argument("--creatures", type=creature_count, default=250)
+    run_parser.add_argument("--generations", type=positive_int, default=100)
+    run_parser.add_argument(
+        "--workers", type=positive_int, default=1, help="processes to evaluate on"
+    )
+    run_parser.add_argument(
+        "--calm-tolerance",
+        type=float,
+        default=None,
+        help="kinetic energy below which a creature stops calming early",
+    )
+    run_parser.add_argument("--seed", type=int, default=None)
+    run_parser.add_argument(
+        "--report-every",
+        type=positive_int,
+        default=10,
+        help="generations between reports",
+    )
+    add_checkpoint_arguments(run_parser)
+    args = parser.parse_args()
+    if args.command == "run":
+        run_headless(args)
+    else:
+        run_interactive(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+import threading
+
+
+class BackgroundGenerations:
+    # Runs generations on a worker thread so the window keeps responding
+    # while they are simulated. At most one generation is in flight. The UI
+    # thread starts it, and collects it once finished to show the results;
+    # the simulation's lock guards the state both threads touch.
+    def __init__(self, sim):
+        self.sim = sim
+        self.thread = None
+        self.error = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        try:
+            self.sim.run_generation()
+        except Exception as e:
+            self.error = e
+
+    def collect(self):
+        # True once, after the generation in flight has finished
+        if self.thread is None or self.thread.is_alive():
+            return False
+        self.wait()
+        return True
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
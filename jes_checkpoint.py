@@ -0,0 +1,295 @@
+import json
+import os
+import threading
+import uuid
+
+import numpy as np
+
+from jes_species_info import SpeciesInfo
+
+# A checkpoint is a small header file at the checkpoint path plus chunk files
+# next to it. Each save writes only what was added since the previous one
+# into a new chunk, so a long run's saves stay the same size instead of
+# rewriting its whole history every time. The header holds the species, the
+# random state and the list of chunks; it is rewritten every time, and
+# swapped in after the new chunk, so a crash mid-save leaves the previous
+# checkpoint intact.
+#
+# Rows of finished generations are never written again, except that the
+# newest generation still gets its fitness, ranks and living flags filled in
+# by the next simulate_generation. So each chunk starts one generation back,
+# superseding the previous chunk's newest generation, and only those columns
+# are copied for a snapshot; the DNA and calm states, which are the bulk of a
+# checkpoint, are handed to the writer thread as views.
+MUTABLE_COLUMNS = ["fitness", "ranks", "living"]
+
+
+def get_header_arrays(sim):
+    arrays = {
+        "creature_count": np.array(sim.creature_count),
+        "trait_count": np.array(sim.trait_count),
+        "species_count": np.array(sim.species_count),
+    }
+    arrays["species_parents"] = np.array(
+        [
+            -1 if info.parent_species is None else info.parent_species
+            for info in sim.species_info
+        ],
+        dtype=int,
+    )
+    arrays["species_apex_pops"] = np.array(
+        [info.apex_pop for info in sim.species_info], dtype=int
+    )
+    arrays["species_representatives"] = np.array(
+        [info.representatives for info in sim.species_info], dtype=int
+    ).reshape((-1, 4))
+    arrays["species_prominent"] = np.array(
+        [info.prominent for info in sim.species_info], dtype=bool
+    )
+    arrays["prominent_species"] = np.array(
+        [
+            [level, s]
+            for level, species in enumerate(sim.prominent_species)
+            for s in species
+        ],
+        dtype=int,
+    ).reshape((-1, 2))
+
+    # the generator's state holds 128-bit integers, so it is kept as JSON
+    arrays["rng_state"] = np.array(json.dumps(sim.rng.bit_generator.state))
+
+    # species names and colors are salted per UI, so keep them stable
+    if sim.ui is not None:
+        arrays["ui_salt"] = np.array(sim.ui.salt)
+        arrays["ui_overridden_species"] = np.array(
+            list(sim.ui.overridden_colors.keys()), dtype=int
+        )
+        arrays["ui_overridden_colors"] = np.array(
+            list(sim.ui.overridden_colors.values()), dtype=str
+        )
+    return arrays
+
+
+def get_chunk_arrays(sim, starts=None):
+    # Everything added since the chunk that ended at starts (None for the
+    # first chunk), and where the next chunk starts.
+    population = sim.population
+    if starts is None:
+        starts = {
+            "generations": 0,
+            "rankings": 0,
+            "percentiles": 0,
+            "calm_frames_saved": 0,
+            "species_pops": 0,
+        }
+    first = starts["generations"]
+    arrays = {"first_generation": np.array(first)}
+    for name, column in population.get_columns().items():
+        column = column[first:]
+        if name in MUTABLE_COLUMNS:
+            column = column.copy()
+        arrays["population_" + name] = column
+    arrays["rankings"] = sim.rankings[starts["rankings"] :]
+    arrays["percentiles"] = sim.percentiles[starts["percentiles"] :]
+    arrays["calm_frames_saved"] = np.array(
+        sim.calm_frames_saved[starts["calm_frames_saved"] :], dtype=int
+    )
+    # one row per (generation, species): population, and the start and end
+    # of the species' band in that generation's stacked chart
+    arrays["species_pops"] = sim.species_pops.get_rows(starts["species_pops"])
+    next_starts = {
+        # the newest generation isn't ranked yet
+        "generations": max(population.generation_count - 1, 0),
+        "rankings": len(sim.rankings),
+        "percentiles": len(sim.percentiles),
+        "calm_frames_saved": len(sim.calm_frames_saved),
+        "species_pops": len(sim.species_pops),
+    }
+    return arrays, next_starts
+
+
+def get_checkpoint_arrays(sim):
+    # the whole run as one set of arrays, as read_checkpoint returns it
+    arrays = get_header_arrays(sim)
+    chunk, _ = get_chunk_arrays(sim)
+    del chunk["first_generation"]
+    arrays.update(chunk)
+    return arrays
+
+
+def write_arrays(path, arrays):
+    # write next to the old file and swap it in, so a crash mid-write never
+    # leaves a truncated file behind
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(temp_path, path)
+
+
+def read_arrays(path):
+    with np.load(path) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+def read_chunk_names(path):
+    # the chunks a checkpoint's header lists, if there is one at path
+    try:
+        with np.load(path) as header:
+            return header["chunks"].tolist()
+    except (OSError, KeyError, ValueError):
+        return []
+
+
+def read_checkpoint(path):
+    arrays = read_arrays(path)
+    directory = os.path.dirname(path)
+    chunks = [
+        read_arrays(os.path.join(directory, name))
+        for name in arrays.pop("chunks").tolist()
+    ]
+    for i, chunk in enumerate(chunks):
+        first = int(chunk.pop("first_generation"))
+        if i + 1 < len(chunks):
+            # the next chunk holds this one's newest generation, ranked
+            end = int(chunks[i + 1]["first_generation"]) - first
+            for name in chunk:
+                if name.startswith("population_"):
+                    chunk[name] = chunk[name][:end]
+    for name in chunks[0]:
+        arrays[name] = np.concatenate([chunk[name] for chunk in chunks])
+    return arrays
+
+
+def restore_checkpoint(sim, arrays):
+    if (
+        int(arrays["creature_count"]) != sim.creature_count
+        or int(arrays["trait_count"]) != sim.trait_count
+    ):
+        raise ValueError(
+            f"checkpoint has {int(arrays['creature_count'])} creatures with "
+            f"{int(arrays['trait_count'])} traits, but the simulation has "
+            f"{sim.creature_count} with {sim.trait_count}"
+        )
+    calmed = arrays["population_calmed"]
+    if len(calmed) == 0 or not calmed[-1].all():
+        # the newest generation's trial would start from zeroed calm states
+        raise ValueError(
+            "checkpoint was taken partway through calming its newest generation"
+        )
+    sim.population.load_columns(
+        {name: arrays["population_" + name] for name in sim.population.columns}
+    )
+    # muscles cached for the replaced population's generations are stale
+    sim.muscle_cache.clear()
+    sim.species_count = int(arrays["species_count"])
+    sim.ranking_history.load(arrays["rankings"])
+    sim.percentile_history.load(arrays["percentiles"])
+    sim.calm_frames_saved = arrays["calm_frames_saved"].tolist()
+
+    sim.species_pops.load_rows(arrays["species_pops"], len(sim.rankings))
+
+    # Species are rebuilt from their first creature and its parent, in the
+    # order they appeared, so each parent's level is known before its child's.
+    sim.species_info = []
+    for parent_species, apex_pop, representatives, prominent in zip(
+        arrays["species_parents"].tolist(),
+        arrays["species_apex_pops"].tolist(),
+        arrays["species_representatives"].tolist(),
+        arrays["species_prominent"].tolist(),
+    ):
+        parent = None
+        if parent_species >= 0:
+            parent = sim.get_create_with_id(representatives[0])
+        info = SpeciesInfo(sim, sim.get_create_with_id(representatives[1]), parent)
+        info.apex_pop = apex_pop
+        info.representatives[:] = representatives
+        info.prominent = prominent
+        sim.species_info.append(info)
+    sim.prominent_species = []
+    for level, s in arrays["prominent_species"].tolist():
+        while len(sim.prominent_species) <= level:
+            sim.prominent_species.append([])
+        sim.prominent_species[level].append(s)
+
+    sim.rng.bit_generator.state = json.loads(str(arrays["rng_state"]))
+
+    if sim.ui is not None and "ui_salt" in arrays:
+        sim.ui.salt = str(arrays["ui_salt"])
+        sim.ui.overridden_colors = dict(
+            zip(
+                arrays["ui_overridden_species"].tolist(),
+                arrays["ui_overridden_colors"].tolist(),
+            )
+        )
+
+
+class Checkpointer:
+    # Writes checkpoints on a background thread, in the order they were
+    # taken. save() only takes the snapshot and queues it, so the generation
+    # loop and the UI, which hold the simulation's lock around it, never wait
+    # on the disk. The first save of a run writes everything so far; resuming
+    # into the same path then drops the old run's chunks.
+    def __init__(self, path):
+        self.path = path
+        # chunks are named after this run, so a resumed run never overwrites
+        # a chunk the old header still lists
+        self.prefix = f"{os.path.basename(path)}.{uuid.uuid4().hex[:8]}"
+        self.chunk_names = []
+        self.starts = None
+        self.written_chunk_names = None
+        self.pending = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.error = None
+
+    def save(self, sim):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        header = get_header_arrays(sim)
+        chunk, self.starts = get_chunk_arrays(sim, self.starts)
+        self.chunk_names.append(f"{self.prefix}.{len(self.chunk_names)}.npz")
+        header["chunks"] = np.array(self.chunk_names)
+        with self.lock:
+            self.pending.append((header, self.chunk_names[-1], chunk))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.write)
+                self.thread.start()
+
+    def write(self):
+        while True:
+            with self.lock:
+                if len(self.pending) == 0 or self.error is not None:
+                    self.pending = []
+                    self.thread = None
+                    return
+                header, chunk_name, chunk = self.pending.pop(0)
+            try:
+                self.write_checkpoint(header, chunk_name, chunk)
+            except Exception as e:
+                # later headers would list this chunk, so nothing more is written
+                self.error = e
+
+    def write_checkpoint(self, header, chunk_name, chunk):
+        if self.written_chunk_names is None:
+            self.written_chunk_names = read_chunk_names(self.path)
+        directory = os.path.dirname(self.path)
+        write_arrays(os.path.join(directory, chunk_name), chunk)
+        write_arrays(self.path, header)
+        chunk_names = header["chunks"].tolist()
+        for name in self.written_chunk_names:
+            if name not in chunk_names:
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+        self.written_chunk_names = chunk_names
+
+    def wait(self):
+        with self.lock:
+            thread = self.thread
+        if thread is not None:
+            thread.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
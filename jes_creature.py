@@ -1,43 +1,79 @@
 import math
-import random
 
 import pygame
 import numpy as np
 
-from utils import array_lerp, clamp, dist_to_text, species_to_color, list_lerp, lerp
+from utils import dist_to_text, species_to_color
+from jes_raster import (
+    draw_cell_layers,
+    fill_circles,
+    get_cell_quads,
+    rasterize_quads,
+    to_surface,
+)
 from jes_shapes import draw_rect, draw_text_rect, display_centered_text, draw_clock
 
 
 class Creature:
-    def __init__(self, dna, id_number, parent_species, _sim, _ui):
-        self.dna = dna
-        self.calm_state = None
-        self.icons = [None] * 2
-        self.icon_coords = None
-        self.id = id_number
-        self.fitness = None
-        self.rank = None
-        self.living = True
-        self.species = self.get_species(parent_species)
+    # A lightweight view of one creature in sim.population; every attribute
+    # is read from the population's columns on access.
+    def __init__(self, _sim, gen, c):
         self.sim = _sim
-        self.ui = _ui
-        self.codon_with_change = None
-
-    def get_species(self, parent_species):
-        return self.id if parent_species == -1 else parent_species
-
-    def draw_cell(self, surface, node_state, frame, transform, x, y):
-        tx, ty, s = transform
-        color = self.traits_to_color(self.dna, x, y, frame)
-        points = [None] * 4
-        # TODO bruh
-        for p in range(4):
-            px = x
-            if p in (1, 2):
-                px += 1
-            py = y + p // 2
-            points[p] = [tx + node_state[px, py, 0] * s, ty + node_state[px, py, 1] * s]
-        pygame.draw.polygon(surface, color, points)
+        self.ui = _sim.ui
+        self.gen = gen
+        self.c = c
+        self.id = gen * _sim.creature_count + c
+        self.color_table = None
+
+    @property
+    def dna(self):
+        return self.sim.population.dna[self.gen, self.c]
+
+    @property
+    def calm_state(self):
+        if not self.sim.population.calmed[self.gen, self.c]:
+            return None
+        return self.sim.population.calm_states[self.gen, self.c]
+
+    def get_icon(self, i):
+        return self.ui.icon_cache.get_icon(
+            self,
+            self.ui.icon_dimension[i],
+            self.ui.mosaic_color,
+            self.sim.beat_fade_time,
+        )
+
+    @property
+    def fitness(self):
+        fitness = self.sim.population.fitness[self.gen, self.c]
+        return None if np.isnan(fitness) else fitness
+
+    @property
+    def rank(self):
+        rank = self.sim.population.ranks[self.gen, self.c]
+        return None if rank < 0 else int(rank)
+
+    @property
+    def living(self):
+        return bool(self.sim.population.living[self.gen, self.c])
+
+    @property
+    def species(self):
+        return int(self.sim.population.species[self.gen, self.c])
+
+    @property
+    def codon_with_change(self):
+        codon = self.sim.population.codon_with_change[self.gen, self.c]
+        return None if codon < 0 else int(codon)
+
+    def get_color_table(self):
+        # built on first use and kept, so a playing movie's creature pays
+        # for it once
+        if self.color_table is None:
+            self.color_table = get_color_table(
+                self.sim, self.dna, self.codon_with_change
+            )
+        return self.color_table
 
     def draw_environment(self, surface, transform):
         black = (0, 0, 0)
@@ -73,15 +109,18 @@ class Creature:
         transform,
         draw_labels: bool,
         should_draw_clock: bool,
+        cell_layer=None,
     ):
+        # cell_layer is this creature's entry from get_cell_layers, for
+        # callers that rasterize many creatures in one batch
         if draw_labels:
             self.draw_environment(surface, transform)
 
-        cell_surface = pygame.Surface(surface.get_size(), pygame.SRCALPHA, 32)
-        for x in range(self.sim.creature_width):
-            for y in range(self.sim.creature_height):
-                self.draw_cell(cell_surface, node_state, frame, transform, x, y)
-        surface.blit(cell_surface, (0, 0))
+        if cell_layer is None:
+            cell_layer = get_cell_layers(
+                [self], [surface.get_size()], [node_state], [frame], [transform]
+            )[0]
+        surface.blit(*cell_layer)
 
         ratio = 1.0
         if draw_labels:
@@ -118,95 +157,96 @@ class Creature:
             )
 
     def draw_icon(self, icon_dimension, background_color, beat_fade_time):
-        icon = pygame.Surface(icon_dimension, pygame.SRCALPHA, 32)
-        icon.fill(background_color)
-        transform = [
-            icon_dimension[0] / 2,
-            icon_dimension[0] / (self.sim.creature_width + 2),
-            icon_dimension[0] / (self.sim.creature_height + 2.85),
-        ]
-        self.draw_creature(
-            icon, self.calm_state, beat_fade_time, transform, False, False
-        )
-        radius = icon_dimension[0] * 0.09
-        radius2 = icon_dimension[0] * 0.12
-        pygame.draw.circle(
-            icon,
-            species_to_color(self.species, self.ui),
-            (icon_dimension[0] - radius2, radius2),
-            radius,
+        icons = draw_icons(
+            self.sim, [self], icon_dimension, background_color, beat_fade_time
         )
-        return icon
-
-    def save_calm_state(self, arr):
-        self.calm_state = arr
-
-    def get_mutated_dna(self, sim):
-        mutation = np.clip(np.random.normal(0.0, 1.0, self.dna.shape[0]), -99, 99)
-        result = self.dna + sim.mutation_rate * mutation
-        new_species = self.species
-
-        big_mut_loc = 0
-        if random.uniform(0, 1) < self.sim.big_mutation_rate:  # do a big mutation
-            new_species = sim.species_count
-            sim.species_count += 1
-            cell_x = random.randint(0, self.sim.creature_width - 1)
-            cell_y = random.randint(0, self.sim.creature_height - 1)
-            cell_beat = random.randint(0, self.sim.beats_per_cycle - 1)
-
-            big_mut_loc = (
-                cell_x * self.sim.creature_height * self.sim.beats_per_cycle
-                + cell_y * self.sim.beats_per_cycle
-                + cell_beat
-            ) * self.sim.traits_per_box
-            for i in range(self.sim.traits_per_box):
-                delta = 0
-                while abs(delta) < 0.5:
-                    delta = np.random.normal(0.0, 1.0, 1)
-                result[big_mut_loc + i] += delta
-
-                # Cells that endure a big mutation are also required to be at
-                # least somewhat rigid, because if a cell goes from super-short
-                # to super-tall but has low rigidity the whole time, then it
-                # doesn't really matter.
-                if i == 2 and result[big_mut_loc + i] < 0.5:
-                    result[big_mut_loc + i] = 0.5
-
-        return result, new_species, big_mut_loc
-
-    def traits_to_color(self, dna, x, y, frame):
-        beat = self.sim.frame_to_beat(frame)
-        beat_prev = (beat + self.sim.beats_per_cycle - 1) % self.sim.beats_per_cycle
-        prog = self.sim.frame_to_beat_fade(frame)
-
-        location_idx = x * self.sim.creature_height + y
-        dna_idx = (
-            location_idx * self.sim.beats_per_cycle + beat
-        ) * self.sim.traits_per_box
-        previous_dna_idx = (
-            location_idx * self.sim.beats_per_cycle + beat_prev
-        ) * self.sim.traits_per_box
-        traits = dna[dna_idx : dna_idx + self.sim.traits_per_box]
-        traits_prev = dna[previous_dna_idx : previous_dna_idx + self.sim.traits_per_box]
-        traits = array_lerp(traits_prev, traits, prog)
-
-        red = clamp(int(128 + traits[0] * 128), 0, 255)
-        green = clamp(int(128 + traits[1] * 128), 0, 255)
-        alpha = clamp(int(155 + traits[2] * 100), 64, 255)
-        color_result = (red, green, 255, alpha)
-
-        if self.codon_with_change is not None:
-            next_green = 0.0
-            if dna_idx <= self.codon_with_change < dna_idx + self.sim.traits_per_box:
-                next_green = 1.0
-            previous_green = 0.0
-            if (
-                previous_dna_idx
-                <= self.codon_with_change
-                < previous_dna_idx + self.sim.traits_per_box
-            ):
-                previous_green = 1.0
-            greenness = lerp(previous_green, next_green, prog)
-            color_result = list_lerp(color_result, (0, 255, 0, 255), greenness)
-
-        return color_result
+        return to_surface(icons[0])
+
+
+def get_cell_layers(creatures, sizes, node_states, frames, transforms):
+    # the cell layers of many creatures, each at its own frame and transform
+    cycle = creatures[0].sim.beat_time * creatures[0].sim.beats_per_cycle
+    return draw_cell_layers(
+        sizes,
+        [
+            get_cell_quads(node_state, transform)
+            for node_state, transform in zip(node_states, transforms)
+        ],
+        [
+            creature.get_color_table()[frame % cycle]
+            for creature, frame in zip(creatures, frames)
+        ],
+    )
+
+
+def draw_icons(sim, creatures, icon_dimension, background_color, frame):
+    # The icons of many creatures in one batch, as a (count, height, width,
+    # 4) BGRA atlas: each creature's calm state at the given frame of its
+    # beat, over the background, with its species' circle in the corner.
+    gens = np.array([creature.gen for creature in creatures], dtype=int)
+    cs = np.array([creature.c for creature in creatures], dtype=int)
+    population = sim.population
+    size = icon_dimension[0]
+    transform = [
+        size / 2,
+        size / (sim.creature_width + 2),
+        size / (sim.creature_height + 2.85),
+    ]
+    quads = get_cell_quads(population.calm_states[gens, cs], transform)
+    colors = get_color_table(
+        sim,
+        population.dna[gens, cs],
+        population.codon_with_change[gens, cs],
+        np.array([frame]),
+    )[:, 0]
+    icons = rasterize_quads(
+        (len(creatures), icon_dimension[1], size), quads, colors, background_color
+    )
+    radius = size * 0.09
+    radius2 = size * 0.12
+    species_colors = [
+        species_to_color(creature.species, creature.ui) for creature in creatures
+    ]
+    return fill_circles(icons, (size - radius2, radius2), radius, species_colors)
+
+
+def get_color_table(sim, dna, codon_with_change, frames=None):
+    # The RGBA color of every cell (x * height + y) at every frame of the
+    # beat cycle: each cell fades from its previous beat's traits to the
+    # current one's, and the codon that changed in the last mutation glows
+    # green. Integer channels unless the green blend makes them fractional.
+    # dna may be a stack of creatures, with an array of changed codons (-1
+    # for none), and frames may pick out only some frames of the cycle.
+    beats = sim.beats_per_cycle
+    if frames is None:
+        frames = np.arange(sim.beat_time * beats)
+    beat = (frames // sim.beat_time) % beats
+    beat_prev = (beat + beats - 1) % beats
+    prog = np.minimum((frames % sim.beat_time) / sim.beat_fade_time, 1)[:, None]
+
+    cell_count = sim.creature_width * sim.creature_height
+    traits = dna[..., : cell_count * beats * sim.traits_per_box].reshape(
+        dna.shape[:-1] + (cell_count, beats, sim.traits_per_box)
+    )
+    traits_prev = traits[..., beat_prev, :].swapaxes(-3, -2)
+    traits = (
+        traits_prev
+        + (traits[..., beat, :].swapaxes(-3, -2) - traits_prev) * prog[:, :, None]
+    )
+
+    colors = np.empty(traits.shape[:-1] + (4,), dtype=int)
+    colors[..., 0] = np.clip((128 + traits[..., 0] * 128).astype(int), 0, 255)
+    colors[..., 1] = np.clip((128 + traits[..., 1] * 128).astype(int), 0, 255)
+    colors[..., 2] = 255
+    colors[..., 3] = np.clip((155 + traits[..., 2] * 100).astype(int), 64, 255)
+    if codon_with_change is None:
+        return colors
+
+    # codon_with_change // traits_per_box is the (cell, beat) it belongs to
+    changed = (np.asarray(codon_with_change) // sim.traits_per_box)[..., None, None]
+    cells = np.arange(cell_count)[None, :]
+    next_green = (cells * beats + beat[:, None] == changed).astype(float)
+    previous_green = (cells * beats + beat_prev[:, None] == changed).astype(float)
+    greenness = previous_green + (next_green - previous_green) * prog
+    green = np.array([0, 255, 0, 255])
+    return colors + (green - colors) * greenness[..., None]
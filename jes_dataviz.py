@@ -1,4 +1,3 @@
-import bisect
 import math
 
 import pygame
@@ -9,163 +8,323 @@ from jes_shapes import right_text, align_text, draw_species_circle
 
 
 def draw_all_graphs(sim, ui):
-    draw_line_graph(
-        sim.percentiles, ui.graph, [70, 0, 30, 30], sim.units_per_meter, ui.small_font
-    )
-    draw_labels(sim.species_pops, ui.labels, [70, 0], ui)
+    ui.line_graph.draw(sim.percentiles, sim.units_per_meter)
+    ui.label_chart.draw(sim.species_pops, ui)
     draw_gene_graph(
         sim.species_info, sim.prominent_species, ui.gene_graph, sim, ui, ui.tiny_font
     )
 
 
-def draw_line_graph(data, graph, margins, u, font):
-    black = (0, 0, 0)
-    gray_25 = (70, 70, 70)
-    gray_50 = (128, 128, 128)
+def get_graph_x_scale(num_generations):
+    # Generations are spread over the next power of two, so the graphs only
+    # change scale (and need redrawing from scratch) when the count doubles.
+    return max(1, 1 << (num_generations - 1).bit_length())
+
+
+def get_bucket_size(num_generations, width):
+    # On long runs there are more generations than pixel columns, so they
+    # are drawn in buckets of a power-of-two size with at most one bucket per
+    # column, and drawing never costs more than the graph is wide.
+    columns = 1 << (int(width).bit_length() - 1)
+    return max(1, get_graph_x_scale(num_generations) // columns)
+
+
+def get_bucket_ends(start, end, bucket_size):
+    # the last generation of every bucket from the one holding start,
+    # including the bucket still being filled
+    ends = list(range(start - start % bucket_size + bucket_size - 1, end, bucket_size))
+    if end % bucket_size != 0:
+        ends.append(end - 1)
+    return ends
+
+
+percentiles_to_display = [
+    0,
+    1,
+    2,
+    3,
+    4,
+    5,
+    6,
+    7,
+    8,
+    9,
+    10,
+    20,
+    30,
+    40,
+    50,
+    60,
+    70,
+    80,
+    90,
+    91,
+    92,
+    93,
+    94,
+    95,
+    96,
+    97,
+    98,
+    99,
+    100,
+]
+
+
+def get_percentile_style(percentile):
     white = (255, 255, 255)
+    gray_50 = (128, 128, 128)
     red = (255, 0, 0)
-
-    graph.fill(black)
-    w = graph.get_width() - margins[0] - margins[1]
-    h = graph.get_height() - margins[2] - margins[3]
-    left = margins[0]
-    right = graph.get_width() - margins[1]
-    bottom = graph.get_height() - margins[3]
-
-    min_val = np.amin(data)
-    max_val = np.amax(data)
-    unit = getUnit((max_val - min_val) / u) * u
-    tick = math.floor(min_val / unit) * unit - unit
-    while tick <= max_val + unit:
-        ay = bottom - h * (tick - min_val) / (max_val - min_val)
-        pygame.draw.line(graph, gray_25, (left, ay), (right, ay), width=1)
-        right_text(graph, dist_to_text(tick, False, u), left - 7, ay, gray_50, font)
-        tick += unit
-
-    percentiles_to_display = [
-        0,
-        1,
-        2,
-        3,
-        4,
-        5,
-        6,
-        7,
-        8,
-        9,
-        10,
-        20,
-        30,
-        40,
-        50,
-        60,
-        70,
-        80,
-        90,
-        91,
-        92,
-        93,
-        94,
-        95,
-        96,
-        97,
-        98,
-        99,
-        100,
-    ]
-    num_generations = len(data)
-    for generation in range(num_generations):
+    if percentile == 50:
+        return red, 3
+    if percentile % 10 == 0:
+        return white, 2
+    return gray_50, 1
+
+
+class LineGraph:
+    # The percentile graph is kept on its surface between generations, and
+    # each new generation only draws its own segments. It is redrawn from
+    # scratch only when the x-scale doubles or the y-range changes; the range
+    # is rounded out to whole tick units, so most generations leave it alone.
+    def __init__(self, graph, margins, font):
+        self.graph = graph
+        self.margins = margins
+        self.font = font
+        self.drawn_count = 0
+        self.x_scale = 0
+        self.min_val = 0
+        self.max_val = 0
+
+    def draw(self, data, u):
+        num_generations = len(data)
+        min_val = np.amin(data)
+        max_val = np.amax(data)
+        unit = getUnit((max_val - min_val) / u) * u
+        min_val = math.floor(min_val / unit) * unit
+        max_val = max(math.ceil(max_val / unit) * unit, min_val + unit)
+        if (
+            num_generations < self.drawn_count
+            or get_graph_x_scale(num_generations) != self.x_scale
+            or min_val != self.min_val
+            or max_val != self.max_val
+        ):
+            self.redraw(data, u, unit, min_val, max_val)
+        else:
+            self.draw_generations(data, self.drawn_count, num_generations)
+        self.drawn_count = num_generations
+
+    def redraw(self, data, u, unit, min_val, max_val):
+        gray_25 = (70, 70, 70)
+        gray_50 = (128, 128, 128)
+        graph = self.graph
+        graph.fill((0, 0, 0))
+        self.x_scale = get_graph_x_scale(len(data))
+        self.min_val = min_val
+        self.max_val = max_val
+
+        h = graph.get_height() - self.margins[2] - self.margins[3]
+        left = self.margins[0]
+        right = graph.get_width() - self.margins[1]
+        bottom = graph.get_height() - self.margins[3]
+        tick = self.min_val
+        while tick <= self.max_val + unit / 2:
+            ay = bottom - h * (tick - self.min_val) / (self.max_val - self.min_val)
+            pygame.draw.line(graph, gray_25, (left, ay), (right, ay), width=1)
+            right_text(
+                graph, dist_to_text(tick, False, u), left - 7, ay, gray_50, self.font
+            )
+            tick += unit
+        self.draw_generations(data, 0, len(data))
+
+    def draw_generations(self, data, start, end):
+        # one polyline per percentile, from the end of generation start - 1
+        # (or from 0 before the first generation) to the end of generation end - 1
+        if start >= end:
+            return
+        graph = self.graph
+        w = graph.get_width() - self.margins[0] - self.margins[1]
+        h = graph.get_height() - self.margins[2] - self.margins[3]
+        left = self.margins[0]
+        bottom = graph.get_height() - self.margins[3]
+        bucket_size = get_bucket_size(self.x_scale, w)
+        if bucket_size > 1:
+            self.draw_buckets(data, start, end, bucket_size)
+            return
+        xs = left + np.arange(start, end + 1) / self.x_scale * w
         for percentile in percentiles_to_display:
-            previous_value = 0 if generation == 0 else data[generation - 1][percentile]
-            next_value = data[generation][percentile]
-
-            x1 = left + (generation / num_generations) * w
-            x2 = left + ((generation + 1) / num_generations) * w
-            y1 = bottom - h * (previous_value - min_val) / (max_val - min_val)
-            y2 = bottom - h * (next_value - min_val) / (max_val - min_val)
-
-            is_important = percentile % 10 == 0
-            thickness = 2 if is_important else 1
-            color = white if is_important else gray_50
-            if percentile == 50:
-                color = red
-                thickness = 3
-            pygame.draw.line(graph, color, (x1, y1), (x2, y2), width=thickness)
-
-
-def draw_labels(data, labels, margins, ui):
-    labels.fill((0, 0, 0))
-    for g in range(len(data)):
-        scan_down_trapezoids(data, g, labels, margins, ui)
-
-
-def scan_down_trapezoids(data, generation_idx, labels, margins, ui):
-    width = labels.get_width() - margins[0] - margins[1]
-    height = labels.get_height()
-    num_generations = len(data)
-    left = margins[0]
-    x1 = left + (generation_idx / num_generations) * width
-    x2 = left + ((generation_idx + 1) / num_generations) * width
-    keys = sorted(list(data[generation_idx].keys()))
-    creature_count = data[generation_idx][keys[-1]][2]  # ending index of the last entry
-    height_per_creature = height / creature_count
-
-    if generation_idx == 0:
-        for sp in data[generation_idx].keys():
-            pop = data[generation_idx][sp]
-            points = [
-                [x1, height / 2],
-                [x1, height / 2],
-                [x2, height - pop[1] * height_per_creature],
-                [x2, height - pop[2] * height_per_creature],
+            values = data[max(start - 1, 0) : end, percentile]
+            if start == 0:
+                values = np.concatenate([[0], values])
+            ys = bottom - h * (values - self.min_val) / (self.max_val - self.min_val)
+            color, thickness = get_percentile_style(percentile)
+            pygame.draw.lines(
+                graph, color, False, np.stack([xs, ys], axis=1).tolist(), thickness
+            )
+
+    def draw_buckets(self, data, start, end, bucket_size):
+        # Each bucket is a band from the lowest to the highest value its
+        # percentile takes in the bucket (or at the end of the one before).
+        # Adding generations to a bucket can only widen its band, so the
+        # bucket still being filled is simply drawn again over itself.
+        graph = self.graph
+        w = graph.get_width() - self.margins[0] - self.margins[1]
+        h = graph.get_height() - self.margins[2] - self.margins[3]
+        left = self.margins[0]
+        bottom = graph.get_height() - self.margins[3]
+        first = start - start % bucket_size
+        values = data[first:end][:, percentiles_to_display]
+        bucket_starts = np.arange(0, end - first, bucket_size)
+        previous = np.concatenate(
+            [
+                (
+                    data[first - 1 : first, percentiles_to_display]
+                    if first > 0
+                    else np.zeros((1, len(percentiles_to_display)))
+                ),
+                values[bucket_starts[1:] - 1],
             ]
-            pygame.draw.polygon(labels, species_to_color(sp, ui), points)
-    else:
-        trapezoid_helper(
-            labels,
-            data,
-            generation_idx,
-            generation_idx - 1,
-            x1,
-            x2,
-            height_per_creature,
-            0,
-            ui,
         )
+        lows = np.minimum(np.minimum.reduceat(values, bucket_starts), previous)
+        highs = np.maximum(np.maximum.reduceat(values, bucket_starts), previous)
+        scale = h / (self.max_val - self.min_val)
+        tops = bottom - (highs - self.min_val) * scale
+        heights = (highs - lows) * scale
+        x1s = left + (first + bucket_starts) / self.x_scale * w
+        x2s = (
+            left
+            + np.minimum(first + bucket_starts + bucket_size, end) / self.x_scale * w
+        )
+        for i, percentile in enumerate(percentiles_to_display):
+            color, thickness = get_percentile_style(percentile)
+            for x1, x2, top, height in zip(
+                x1s.tolist(), x2s.tolist(), tops[:, i].tolist(), heights[:, i].tolist()
+            ):
+                pygame.draw.rect(
+                    graph,
+                    color,
+                    (x1, top - thickness / 2, x2 - x1 + 1, height + thickness),
+                )
+
+
+class LabelChart:
+    # The species chart is kept on its surface between generations and, like
+    # the percentile graph, each new generation only draws its own column.
+    # It is redrawn from scratch when the x-scale doubles or species colors
+    # change.
+    def __init__(self, labels, margins):
+        self.labels = labels
+        self.margins = margins
+        self.drawn_count = 0
+        self.x_scale = 0
+        self.color_key = None
+
+    def draw(self, data, ui):
+        num_generations = len(data)
+
+        width = self.labels.get_width() - self.margins[0] - self.margins[1]
+        bucket_size = get_bucket_size(num_generations, width)
+        color_key = (ui.salt, tuple(sorted(ui.overridden_colors.items())))
+        start = self.drawn_count
+        if (
+            num_generations < self.drawn_count
+            or get_graph_x_scale(num_generations) != self.x_scale
+            or color_key != self.color_key
+        ):
+            self.labels.fill((0, 0, 0))
+            self.x_scale = get_graph_x_scale(num_generations)
+            self.color_key = color_key
+            start = 0
+
+        # a bucket that was drawn before it was full is drawn again
+        first = start - start % bucket_size
+        previous_idx = first - 1 if first > 0 else None
+        if first < start:
+            x1 = self.get_x(previous_idx)
+            self.labels.fill(
+                (0, 0, 0),
+                (int(x1), 0, self.labels.get_width(), self.labels.get_height()),
+            )
+        for g in get_bucket_ends(start, num_generations, bucket_size):
+            self.draw_generation(data, g, previous_idx, ui)
+            previous_idx = g
+        self.drawn_count = num_generations
+
+    def get_x(self, generation_idx):
+        # where the chart is at the end of generation generation_idx
+        width = self.labels.get_width() - self.margins[0] - self.margins[1]
+        if generation_idx is None:
+            return self.margins[0]
+        return self.margins[0] + (generation_idx + 1) / self.x_scale * width
+
+    def draw_generation(self, data, generation_idx, previous_idx, ui):
+        # draws the bands from the end of generation previous_idx to the end of
+        # generation generation_idx; each bucket is drawn from its last generation
+        height = self.labels.get_height()
+        x1 = self.get_x(previous_idx)
+        x2 = self.get_x(generation_idx)
+        species, starts, ends = get_band_columns(data, generation_idx)
+        height_per_creature = height / ends[-1]
+
+        if previous_idx is None:
+            for sp, start, end in zip(species.tolist(), starts.tolist(), ends.tolist()):
+                points = [
+                    [x1, height / 2],
+                    [x1, height / 2],
+                    [x2, height - start * height_per_creature],
+                    [x2, height - end * height_per_creature],
+                ]
+                pygame.draw.polygon(self.labels, species_to_color(sp, ui), points)
+        else:
+            trapezoid_helper(
+                self.labels,
+                (species, starts, ends),
+                get_band_columns(data, previous_idx),
+                x1,
+                x2,
+                height_per_creature,
+                0,
+                ui,
+            )
+
+
+def get_band_columns(data, generation_idx):
+    # a generation's species in ID order, with where each one's band of the
+    # stacked chart starts and ends
+    species, _, starts, ends = data.get_generation(generation_idx)
+    return species, starts, ends
 
 
 # TODO naming
-def get_range_even_if_none(dicty, key):
-    keys = sorted(list(dicty.keys()))
-    if key in keys:
-        return dicty[key]
+def get_range_even_if_none(columns, key):
+    species, starts, ends = columns
+    n = np.searchsorted(species, key)
+    if n < len(species) and species[n] == key:
+        return [ends[n] - starts[n], starts[n], ends[n]]
+    elif n >= len(species):
+        val = ends[-1]
     else:
-        n = bisect.bisect(keys, key + 0.5)
-        if n >= len(keys):
-            val = dicty[keys[n - 1]][2]
-        else:
-            val = dicty[keys[n]][1]
-        return [0, val, val]
+        val = starts[n]
+    return [0, val, val]
 
 
 # TODO bruh naming
 def trapezoid_helper(
-    label_surface, data, g1, g2, x1, x2, pixels_per_creature, level, ui
+    label_surface, columns1, columns2, x1, x2, pixels_per_creature, level, ui
 ):
     pop2 = [0, 0, 0]
     h = label_surface.get_height()
-    for sp in data[g1].keys():
-        pop1 = data[g1][sp]
-        if level == 0 and pop1[1] != pop2[2]:  # there was a gap
+    for sp, start, end in zip(*(column.tolist() for column in columns1)):
+        if level == 0 and start != pop2[2]:  # there was a gap
             trapezoid_helper(
-                label_surface, data, g2, g1, x2, x1, pixels_per_creature, 1, ui
+                label_surface, columns2, columns1, x2, x1, pixels_per_creature, 1, ui
             )
-        pop2 = get_range_even_if_none(data[g2], sp)
+        pop2 = get_range_even_if_none(columns2, sp)
         points = [
             [x1, h - pop2[1] * pixels_per_creature],
             [x1, h - pop2[2] * pixels_per_creature],
-            [x2, h - pop1[2] * pixels_per_creature],
-            [x2, h - pop1[1] * pixels_per_creature],
+            [x2, h - end * pixels_per_creature],
+            [x2, h - start * pixels_per_creature],
         ]
         pygame.draw.polygon(label_surface, species_to_color(sp, ui), points)
 
@@ -175,7 +334,7 @@ def draw_gene_graph(species_info, prominent_species, gene_graph, sim, ui, font):
     h = gene_graph.get_height() - r * 2
     w = gene_graph.get_width() - r * 2
     gene_graph.fill((0, 0, 0))
-    if len(sim.creatures) == 0:
+    if sim.population.generation_count == 0:
         return
 
     for level in range(len(prominent_species)):
@@ -215,6 +374,14 @@ def display_all_graphs(screen, sim, ui):
             white,
             ui.small_font,
         )
+        right_text(
+            screen,
+            sim.get_stage_report(int(ui.generation_slider.val_max) - 1),
+            1800,
+            62,
+            ui.grayish,
+            ui.tiny_font,
+        )
 
 
 def blit_graphs_and_marks(screen, sim, ui):
@@ -228,8 +395,9 @@ def blit_graphs_and_marks(screen, sim, ui):
     if b == 0:
         return
 
+    x_scale = get_graph_x_scale(b)
     if a < b:
-        frac = (a + 1) / b
+        frac = (a + 1) / x_scale
         line_x = ui.label_coords[0] + 70 + (ui.graph.get_width() - 70) * frac
         line_ys = [[50, 550], [560, 860]]
         for line_y in line_ys:
@@ -237,7 +405,7 @@ def blit_graphs_and_marks(screen, sim, ui):
                 screen, green, (line_x, line_y[0]), (line_x, line_y[1]), width=2
             )
 
-    frac = (a2 + 1) / b
+    frac = (a2 + 1) / x_scale
     line_x = ui.label_coords[0] + 70 + (ui.graph.get_width() - 70) * frac
     median = sim.percentiles[a2][50]
     right_text(
@@ -249,18 +417,20 @@ def blit_graphs_and_marks(screen, sim, ui):
         ui.small_font,
     )
 
-    top_species = get_top_species(sim, a2)
-    for sp in sim.species_pops[a2].keys():
-        pop = sim.species_pops[a2][sp]
-        if pop[0] >= sim.creature_count * sim.s_visible:
-            species_i = (pop[1] + pop[2]) / 2
+    top_species = sim.species_pops.get_top_species(a2)
+    species, pops, starts, ends = sim.species_pops.get_generation(a2)
+    for sp, pop, start, end in zip(
+        species.tolist(), pops.tolist(), starts.tolist(), ends.tolist()
+    ):
+        if pop >= sim.creature_count * sim.s_visible:
+            species_i = (start + end) / 2
             species_y = 560 + 300 * (1 - species_i / sim.creature_count)
             name = species_to_name(sp, ui)
             color = species_to_color(sp, ui)
             outline_color = ui.white if sp == top_species else None
             align_text(
                 screen,
-                f"{name}: {pop[0]}",
+                f"{name}: {pop}",
                 line_x + 10,
                 species_y,
                 color,
@@ -278,11 +448,12 @@ def blit_gene_graph_and_marks(screen, sim, ui):
     a2 = min(a, b - 1)
     if b == 0:
         return
-    top_species = get_top_species(sim, a2)
+    top_species = sim.species_pops.get_top_species(a2)
 
-    for sp in sim.species_pops[a2].keys():
+    for sp in sim.species_pops.get_generation(a2)[0].tolist():
         info = sim.species_info[sp]
-        if not info.prominent:
+        # a species can turn prominent in the background before it is drawn
+        if not info.prominent or info.coords is None:
             continue
         circle_count = 2 if sp == top_species else 1
         cx = info.coords[0] + ui.ancestry_tree_coords[0]
@@ -292,14 +463,9 @@ def blit_gene_graph_and_marks(screen, sim, ui):
 
     if ui.species_storage is not None:
         sp = ui.species_storage
-        if sp in sim.species_pops[a2]:
+        if sim.species_pops.get_population(a2, sp) > 0:
             circle_count = 2 if sp == top_species else 1
             for c in range(circle_count):
                 pygame.draw.circle(
                     screen, ui.white, ui.storage_coor, radius + 3 + 6 * c, 3
                 )
-
-
-def get_top_species(sim, g):
-    data = sim.species_pops[g]
-    return max(data, key=data.get)
@@ -0,0 +1,56 @@
+from collections import OrderedDict
+from hashlib import sha256
+
+
+class FitnessCache:
+    # The physics is deterministic, so a genome (DNA bytes plus the physics
+    # parameters it was simulated under) always calms down to the same state
+    # and scores the same fitness. Entries are [calm_state, fitness] and are
+    # evicted least-recently-used once there are more than max_size.
+    def __init__(self, max_size, physics_key):
+        self.max_size = max_size
+        self.physics_key = physics_key.encode("utf-8")
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_key(self, dna):
+        return sha256(self.physics_key + dna.tobytes()).digest()
+
+    def lookup(self, key, slot):
+        entry = self.entries.get(key)
+        if entry is None or entry[slot] is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[slot]
+
+    def store(self, key, slot, value):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = [None, None]
+            self.entries[key] = entry
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.entries.move_to_end(key)
+        entry[slot] = value
+
+    def get_calm_state(self, key):
+        return self.lookup(key, 0)
+
+    def put_calm_state(self, key, calm_state):
+        self.store(key, 0, calm_state)
+
+    def get_fitness(self, key):
+        return self.lookup(key, 1)
+
+    def put_fitness(self, key, fitness):
+        self.store(key, 1, fitness)
+
+    def get_hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
@@ -0,0 +1,71 @@
+from collections import OrderedDict
+
+from jes_creature import draw_icons
+from jes_raster import to_surface
+from utils import species_to_color
+
+
+class IconCache:
+    # Creature icons are drawn the first time something asks for them and
+    # kept here, keyed by (creature id, icon size, species color) so that
+    # recoloring a species simply misses. Entries are evicted least-recently-
+    # used once the surfaces take up more than max_bytes.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_icon(self, creature, icon_dimension, background_color, beat_fade_time):
+        return self.get_icons(
+            [creature], icon_dimension, background_color, beat_fade_time
+        )[0]
+
+    def get_icons(self, creatures, icon_dimension, background_color, beat_fade_time):
+        # every icon that misses is drawn in one batch
+        keys = [
+            (
+                creature.id,
+                tuple(icon_dimension),
+                species_to_color(creature.species, creature.ui),
+            )
+            for creature in creatures
+        ]
+        icons = [self.entries.get(key) for key in keys]
+        missing = []
+        for i, (key, icon) in enumerate(zip(keys, icons)):
+            if icon is None:
+                missing.append(i)
+            else:
+                self.entries.move_to_end(key)
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if len(missing) == 0:
+            return icons
+
+        atlas = draw_icons(
+            creatures[0].sim,
+            [creatures[i] for i in missing],
+            icon_dimension,
+            background_color,
+            beat_fade_time,
+        )
+        for i, image in zip(missing, atlas):
+            icons[i] = self.entries[keys[i]] = to_surface(image)
+            self.bytes += get_surface_bytes(icons[i])
+        # never evict the icons we were just asked for
+        while self.bytes > self.max_bytes and len(self.entries) > len(set(keys)):
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= get_surface_bytes(evicted)
+            self.evictions += 1
+        return icons
+
+    def get_hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+
+def get_surface_bytes(surface):
+    return surface.get_pitch() * surface.get_height()
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+class MovieBatch:
+    # The movies playing at the same time: one creature's, a species' four
+    # representatives or a sample of eight. The simulated ones are packed into
+    # a single batch of the movie engine and stepped together once per frame.
+    # Movies can start at different times, so each keeps its own frame and
+    # the engine mixes their beats. Recorded movies step through their
+    # recording instead.
+    def __init__(self, sim):
+        self.sim = sim
+        self.engine = sim.movie_physics
+        # per movie: [node coords or recording, muscles or None, frame]
+        self.movies = []
+        # movies in the engine's batch, and their node coords; the node coords
+        # of each of those movies are a view into node_coords
+        self.playing = None
+        self.node_coords = None
+
+    def __len__(self):
+        return len(self.movies)
+
+    def clear(self):
+        self.movies = []
+        self.playing = None
+
+    def add(self, gen, c):
+        self.movies.append(list(self.sim.import_movie(gen, c)))
+        self.playing = None
+
+    def pack(self):
+        self.playing = [
+            i
+            for i, (_, muscles, frame) in enumerate(self.movies)
+            if muscles is not None and frame < self.sim.trial_time
+        ]
+        if len(self.playing) == 0:
+            return
+        self.node_coords = np.concatenate([self.movies[i][0] for i in self.playing])
+        for j, i in enumerate(self.playing):
+            self.movies[i][0] = self.node_coords[j : j + 1]
+        self.engine.bind(
+            len(self.playing),
+            np.concatenate([self.movies[i][1] for i in self.playing]),
+        )
+        self.engine.load(self.node_coords)
+
+    def advance(self):
+        for movie in self.movies:
+            if movie[1] is None and movie[2] < self.sim.trial_time:
+                movie[2] += 1
+        # movies that were added or have finished change the batch
+        if self.playing is None or any(
+            self.movies[i][2] >= self.sim.trial_time for i in self.playing
+        ):
+            self.pack()
+        if len(self.playing) == 0:
+            return
+        beats = [self.engine.frame_to_beat(self.movies[i][2]) for i in self.playing]
+        beat = beats[0]
+        if any(b != beat for b in beats):
+            beat = self.engine.set_mixed_beats(beats)
+        self.engine.step(beat, False)
+        self.engine.store(self.node_coords)
+        for i in self.playing:
+            self.movies[i][2] += 1
+
+    def get_frame(self, i):
+        node_coords, muscles, current_frame = self.movies[i]
+        if muscles is None:
+            frame = current_frame // self.sim.trajectories.decimation
+            # recordings are float32; drawing expects the simulation's float64
+            node_coords = node_coords[frame : frame + 1].astype(np.float64)
+        return node_coords, current_frame
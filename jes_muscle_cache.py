@@ -0,0 +1,41 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from jes_physics import set_muscles
+
+
+class MuscleCache:
+    # Muscle tensors of whole generations, built from the generation's DNA
+    # matrix the first time a run needs one. The calming run, the trial, the
+    # recorded trials and the movies of a generation all slice the same
+    # tensor. The most recently used generations are kept; both the
+    # generation loop and the UI's movies read it, so lookups are locked.
+    def __init__(self, generation_count, muscle_shape, traits_per_box):
+        self.generation_count = generation_count
+        self.muscle_shape = muscle_shape
+        self.traits_per_box = traits_per_box
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_muscles(self, gen, dna):
+        with self.lock:
+            muscles = self.entries.get(gen)
+            if muscles is not None:
+                self.entries.move_to_end(gen)
+                self.hits += 1
+                return muscles
+            self.misses += 1
+            muscles = np.zeros((len(dna),) + self.muscle_shape)
+            set_muscles(muscles, dna, self.traits_per_box)
+            self.entries[gen] = muscles
+            if len(self.entries) > self.generation_count:
+                self.entries.popitem(last=False)
+            return muscles
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
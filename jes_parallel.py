@@ -0,0 +1,149 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from jes_physics import (
+    PhysicsEngine,
+    set_grid_node_coords,
+    set_lifted_node_coords,
+    set_muscles,
+)
+
+# Each worker process builds one engine and attaches to the shared population
+# buffers once, then reuses both for every shard it is handed.
+_engine = None
+_buffers = None
+
+
+def _init_worker(physics_params, buffer_specs):
+    global _engine, _buffers
+    _engine = PhysicsEngine(**physics_params)
+    _buffers = SharedPopulationBuffers.attach(buffer_specs)
+
+
+def _run_shard(
+    start_idx, end_idx, frame_count, calming_run, calm_tolerance, traits_per_box, lift
+):
+    # Everything is read from and written to the shared buffers in place;
+    # only the shard bounds and the frames saved travel through the pool.
+    muscles = _buffers.muscles[start_idx:end_idx]
+    calm_states = _buffers.calm_states[start_idx:end_idx]
+    set_muscles(muscles, _buffers.dna[start_idx:end_idx], traits_per_box)
+    if calming_run:
+        set_grid_node_coords(calm_states)
+        return _engine.run(calm_states, muscles, 0, frame_count, True, calm_tolerance)
+    node_coords = np.zeros(calm_states.shape)
+    set_lifted_node_coords(node_coords, calm_states, lift)
+    _engine.run(node_coords, muscles, 0, frame_count, False)
+    # find each creature's average X-coordinate
+    _buffers.final_scores[start_idx:end_idx] = node_coords[:, :, :, 0].mean(axis=(1, 2))
+    return 0
+
+
+class SharedPopulationBuffers:
+    # The population's DNA matrix, muscle tensor, calm states and final
+    # scores, each living in a multiprocessing.shared_memory block with a
+    # NumPy view on top. The blocks are sized to the population once and
+    # reused for every generation.
+    NAMES = ["dna", "muscles", "calm_states", "final_scores"]
+
+    def __init__(self, blocks, shapes):
+        self.blocks = blocks
+        self.shapes = shapes
+        for name in self.NAMES:
+            array = np.ndarray(shapes[name], dtype=np.float64, buffer=blocks[name].buf)
+            setattr(self, name, array)
+
+    @classmethod
+    def create(cls, shapes):
+        blocks = {}
+        for name in cls.NAMES:
+            size = int(np.prod(shapes[name])) * np.dtype(np.float64).itemsize
+            blocks[name] = SharedMemory(create=True, size=size)
+        return cls(blocks, shapes)
+
+    @classmethod
+    def attach(cls, specs):
+        blocks = {name: SharedMemory(name=specs[name][0]) for name in cls.NAMES}
+        return cls(blocks, {name: specs[name][1] for name in cls.NAMES})
+
+    def get_specs(self):
+        return {
+            name: (self.blocks[name].name, self.shapes[name]) for name in self.NAMES
+        }
+
+    def close(self, unlink):
+        for name in self.NAMES:
+            # drop our views before the underlying buffers go away
+            setattr(self, name, None)
+            self.blocks[name].close()
+            if unlink:
+                self.blocks[name].unlink()
+
+
+class ShardedEvaluator:
+    def __init__(self, sim, worker_count):
+        self.worker_count = worker_count
+        self.traits_per_box = sim.traits_per_box
+        self.lift = sim.creature_height
+        count = sim.creature_count
+        nodes = (sim.creature_height + 1, sim.creature_width + 1, sim.node_coord_size)
+        self.buffers = SharedPopulationBuffers.create(
+            {
+                "dna": (count, sim.trait_count),
+                "muscles": (
+                    count,
+                    sim.creature_height,
+                    sim.creature_width,
+                    sim.beats_per_cycle,
+                    sim.traits_per_box + 1,
+                ),
+                "calm_states": (count,) + nodes,
+                "final_scores": (count,),
+            }
+        )
+        # "spawn" keeps workers free of the parent's SDL window and threads.
+        self.pool = ProcessPoolExecutor(
+            max_workers=worker_count,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(sim.physics_params, self.buffers.get_specs()),
+        )
+
+    def get_shards(self, start_idx, end_idx):
+        bounds = np.linspace(start_idx, end_idx, self.worker_count + 1).astype(int)
+        return [(s, e) for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
+
+    def run(self, sim, gen, indices, frame_count, calming_run):
+        # Creatures never interact, so each shard is simulated on its own. The
+        # batch is packed at the front of the shared buffers; the returned
+        # array is a view into them and is overwritten by the next run.
+        count = len(indices)
+        sim.get_dna_matrix(gen, indices, out=self.buffers.dna[:count])
+        if not calming_run:
+            sim.get_calm_state_matrix(
+                gen, indices, out=self.buffers.calm_states[:count]
+            )
+        futures = [
+            self.pool.submit(
+                _run_shard,
+                s,
+                e,
+                frame_count,
+                calming_run,
+                sim.calm_tolerance,
+                self.traits_per_box,
+                self.lift,
+            )
+            for s, e in self.get_shards(0, count)
+        ]
+        frames_saved = sum(future.result() for future in futures)
+        if calming_run:
+            return self.buffers.calm_states[:count], frames_saved
+        return self.buffers.final_scores[:count].copy(), frames_saved
+
+    def close(self):
+        self.pool.shutdown()
+        self.buffers.close(True)
@@ -0,0 +1,415 @@
+import tracemalloc
+
+import numpy as np
+
+
+class PhysicsEngine:
+    # Nodes are stored flat, one padded (height + 2) x (width + 2) block per
+    # creature: the extra row and column hold "ghost" nodes parked far away
+    # from the jelly. With that padding, every spring of a given orientation
+    # connects node i to node i + offset, so each spring family (and each
+    # force update) is a single contiguous 1-D slice. Strided views would make
+    # NumPy allocate iteration buffers on every call.
+    GHOST_COORD = 1e6
+    # how often (in frames) a calming run with a tolerance checks which
+    # creatures have settled; compacting the batch isn't free.
+    SETTLE_CHECK_INTERVAL = 10
+
+    def __init__(
+        self,
+        *,
+        creature_dimensions,
+        beat_time,
+        beats_per_cycle,
+        y_clips,
+        ground_friction_coef,
+        gravity_acceleration_coef,
+        calming_friction_coef,
+        typical_friction_coef,
+        muscle_coef,
+    ):
+        self.creature_width, self.creature_height = creature_dimensions
+        self.beat_time = beat_time
+        self.beats_per_cycle = beats_per_cycle
+        self.ceiling_y, self.floor_y = y_clips
+        self.ground_friction_coef = ground_friction_coef
+        self.gravity_acceleration_coef = gravity_acceleration_coef
+        self.calming_friction_coef = calming_friction_coef
+        self.typical_friction_coef = typical_friction_coef
+        self.muscle_coef = muscle_coef
+
+        # padded block: rows along axis 1 of node_coords, columns along axis 2
+        self.rows = self.creature_height + 2
+        self.cols = self.creature_width + 2
+        self.block_size = self.rows * self.cols
+        c = self.cols
+        # flat offsets of the four spring families (down, right, both diagonals)
+        self.family_offsets = [(0, c), (0, 1), (0, c + 1), (1, c)]
+        # (family, shift from the cell's top-left node, rest length (0: width,
+        # 1: height, 2: diagonal), first node offset, second node offset)
+        self.springs_layout = [
+            (0, 0, 0, 0, c),
+            (0, 1, 0, 1, c + 1),
+            (1, 0, 1, 0, 1),
+            (1, c, 1, c, c + 1),
+            (2, 0, 2, 0, c + 1),
+            (3, 0, 2, 1, c),
+        ]
+
+        self.capacity = 0
+        self.count = None
+        self.muscles = None
+
+    def reserve(self, count):
+        # Scratch buffers only ever grow, so a population-sized engine can be
+        # reused for any smaller batch (e.g. a single-creature movie).
+        if count <= self.capacity:
+            return
+        size = count * self.block_size
+        self.state_buffer = np.zeros((4, size))
+        self.family_buffers = np.zeros((4, 4, size))
+        self.attraction_buffer = np.zeros(size)
+        self.force_buffer = np.zeros(size)
+        self.ground_buffer = np.zeros(size)
+        self.energy_buffer = np.zeros((2, count))
+        self.settled_buffer = np.zeros(count, dtype=bool)
+        self.spring_constant_buffer = np.zeros(size)
+        # one slot per beat, plus one for batches whose creatures are at
+        # different beats (see set_mixed_beats)
+        self.rest_length_buffer = np.zeros((self.beats_per_cycle + 1, 3, size))
+        self.capacity = count
+        self.count = None
+        self.muscles = None
+
+    def bind(self, count, muscles):
+        # All views used by step() are built here, once per batch, so the
+        # per-frame work never creates new arrays.
+        if count != self.count:
+            self.reserve(count)
+            self.count = count
+            self.build_views()
+            self.muscles = None
+        if muscles is not self.muscles:
+            self.muscles = muscles
+            self.load_muscles(muscles)
+
+    def build_views(self):
+        size = self.count * self.block_size
+        # every spring is addressed by its cell's top-left node; only nodes
+        # whose springs stay inside the batch take part.
+        span = size - (self.cols + 1)
+        self.state = self.state_buffer[:, :size]
+        self.x, self.y, self.vx, self.vy = self.state
+        self.blocks = self.state.reshape(4, self.count, self.rows, self.cols)
+
+        self.families = []
+        for (a, b), buffers in zip(self.family_offsets, self.family_buffers):
+            dx, dy, length, scratch = buffers[:, : size - b]
+            self.families.append(
+                (
+                    self.x[a : size - b + a],
+                    self.x[b:size],
+                    self.y[a : size - b + a],
+                    self.y[b:size],
+                    dx,
+                    dy,
+                    length,
+                    scratch,
+                )
+            )
+
+        self.attraction = self.attraction_buffer[:span]
+        self.force = self.force_buffer[:span]
+        self.ground = self.ground_buffer[:size]
+        self.ground_blocks = self.ground.reshape(self.count, self.block_size)
+        self.energy, self.energy_scratch = self.energy_buffer[:, : self.count]
+        self.settled = self.settled_buffer[: self.count]
+
+        # Ghost springs are switched off by giving them a spring constant of 0.
+        # That alone won't hold back a NaN (a creature with a zero-length
+        # spring has 0 / 0 directions, and 0 * NaN is NaN), so the ghost
+        # nodes' velocities are also zeroed every step: the ghosts stay parked
+        # and a broken creature can't reach its neighbours through them.
+        spring_constants = self.spring_constant_buffer[:size]
+        spring_constants[:] = 0
+        spring_constants.reshape(self.count, self.rows, self.cols)[
+            :, : self.creature_height, : self.creature_width
+        ] = self.muscle_coef
+        self.spring_constants = spring_constants[:span]
+        velocity_blocks = self.blocks[2:]
+        self.ghost_velocities = [
+            velocity_blocks[:, :, self.creature_height + 1],
+            velocity_blocks[:, :, : self.creature_height + 1, self.creature_width + 1],
+        ]
+
+        self.springs = []
+        for family, shift, rest, first, second in self.springs_layout:
+            _, _, _, _, nx, ny, length, _ = self.families[family]
+            self.springs.append(
+                (
+                    nx[shift : shift + span],
+                    ny[shift : shift + span],
+                    length[shift : shift + span],
+                    [beat[rest, :span] for beat in self.rest_length_buffer],
+                    self.vx[first : first + span],
+                    self.vy[first : first + span],
+                    self.vx[second : second + span],
+                    self.vy[second : second + span],
+                )
+            )
+
+    def load_muscles(self, muscles):
+        # Rest lengths (widths, heights and diagonals) per beat, laid out on
+        # the padded grid.
+        h = self.creature_height
+        w = self.creature_width
+        rest_lengths = self.rest_length_buffer[
+            : self.beats_per_cycle, :, : self.count * self.block_size
+        ]
+        grid = rest_lengths.reshape(
+            self.beats_per_cycle, 3, self.count, self.rows, self.cols
+        )
+        for i, trait in enumerate((0, 1, 3)):
+            grid[:, i, :, :h, :w] = np.moveaxis(muscles[:, :, :, :, trait], 3, 0)
+
+    def frame_to_beat(self, f):
+        return (f // self.beat_time) % self.beats_per_cycle
+
+    def set_mixed_beats(self, beats):
+        # Fills the extra rest-length slot with each creature's lengths at its
+        # own beat, and returns the beat to step() with.
+        size = self.count * self.block_size
+        loaded = self.rest_length_buffer[: self.beats_per_cycle, :, :size].reshape(
+            self.beats_per_cycle, 3, self.count, self.block_size
+        )
+        mixed = self.rest_length_buffer[self.beats_per_cycle, :, :size].reshape(
+            3, self.count, self.block_size
+        )
+        for i, beat in enumerate(beats):
+            mixed[:, i] = loaded[beat, :, i]
+        return self.beats_per_cycle
+
+    def load(self, node_coords):
+        h = self.creature_height
+        w = self.creature_width
+        # ghosts sit far above the ground, spread out so no spring between
+        # them ever has zero length.
+        self.blocks[0] = self.GHOST_COORD + np.arange(self.block_size).reshape(
+            self.rows, self.cols
+        )
+        self.blocks[1] = -self.GHOST_COORD
+        self.blocks[2:] = 0
+        for i in range(4):
+            self.blocks[i, :, : h + 1, : w + 1] = node_coords[:, :, :, i]
+
+    def store(self, node_coords):
+        h = self.creature_height
+        w = self.creature_width
+        for i in range(4):
+            node_coords[:, :, :, i] = self.blocks[i, :, : h + 1, : w + 1]
+
+    def record_frame(self, record, frame):
+        h = self.creature_height
+        w = self.creature_width
+        for i in range(2):
+            record[:, frame, :, :, i] = self.blocks[i, :, : h + 1, : w + 1]
+
+    def store_rows(self, node_coords, rows, blocks):
+        h = self.creature_height
+        w = self.creature_width
+        for i in range(4):
+            node_coords[rows, :, :, i] = self.blocks[i, blocks, : h + 1, : w + 1]
+
+    def compact(self, keep):
+        # Drop creatures from the active batch, sliding the survivors' node
+        # blocks and rest lengths down to the front of the buffers.
+        count = np.count_nonzero(keep)
+        self.blocks[:, :count] = self.blocks[:, keep]
+        rest_lengths = self.rest_length_buffer[
+            : self.beats_per_cycle, :, : self.count * self.block_size
+        ]
+        grid = rest_lengths.reshape(
+            self.beats_per_cycle, 3, self.count, self.rows, self.cols
+        )
+        grid[:, :, :count] = grid[:, :, keep]
+        self.count = count
+        self.build_views()
+        # the rest lengths no longer match the caller's muscles array
+        self.muscles = None
+
+    def get_kinetic_energy(self):
+        # per-creature sum of 1/2 v^2 over every node (ghosts never move in
+        # a calming run, so they contribute nothing)
+        np.square(self.vx, out=self.ground)
+        np.sum(self.ground_blocks, axis=1, out=self.energy)
+        np.square(self.vy, out=self.ground)
+        np.sum(self.ground_blocks, axis=1, out=self.energy_scratch)
+        self.energy += self.energy_scratch
+        self.energy *= 0.5
+        return self.energy
+
+    def run(
+        self,
+        node_coords,
+        muscles,
+        start_frame,
+        frame_count,
+        calming_run,
+        calm_tolerance=None,
+        record=None,
+        record_every=1,
+    ):
+        # Returns how many creature-frames were skipped because creatures
+        # settled early; that only happens in calming runs with a tolerance.
+        # If record is given, every record_every-th frame's node positions
+        # (starting with the initial state) are written into it.
+        self.bind(node_coords.shape[0], muscles)
+        self.load(node_coords)
+        frames_saved = 0
+        if calming_run and calm_tolerance is not None:
+            frames_saved = self.run_until_settled(
+                node_coords, frame_count, calm_tolerance
+            )
+        else:
+            if record is not None:
+                self.record_frame(record, 0)
+            for f in range(frame_count):
+                beat = 0 if calming_run else self.frame_to_beat(start_frame + f)
+                self.step(beat, calming_run)
+                if record is not None and (f + 1) % record_every == 0:
+                    self.record_frame(record, (f + 1) // record_every)
+            self.store(node_coords)
+
+        # If it's a calming run, then take the average location of all nodes to center it at the origin.
+        if calming_run:
+            node_coords[:, :, :, 0] -= np.mean(
+                node_coords[:, :, :, 0], axis=(1, 2), keepdims=True
+            )
+        return frames_saved
+
+    def run_until_settled(self, node_coords, frame_count, calm_tolerance):
+        # Creatures whose kinetic energy drops below calm_tolerance are
+        # written out and removed from the batch; the run stops as soon as
+        # every creature has settled.
+        active = np.arange(self.count)
+        frames_saved = 0
+        for f in range(frame_count):
+            self.step(0, True)
+            if (f + 1) % self.SETTLE_CHECK_INTERVAL != 0:
+                continue
+            np.less(self.get_kinetic_energy(), calm_tolerance, out=self.settled)
+            if not self.settled.any():
+                continue
+            settled = self.settled.copy()
+            self.store_rows(node_coords, active[settled], settled)
+            frames_saved += (frame_count - 1 - f) * np.count_nonzero(settled)
+            keep = ~settled
+            active = active[keep]
+            if len(active) == 0:
+                return frames_saved
+            self.compact(keep)
+        self.store_rows(node_coords, active, slice(None))
+        return frames_saved
+
+    def step(self, beat, calming_run):
+        if not calming_run:
+            # decrease y-velo (3rd node coords) by G
+            self.vy += self.gravity_acceleration_coef
+
+        self.apply_muscles(beat)
+        for ghost_velocities in self.ghost_velocities:
+            ghost_velocities[:] = 0
+        friction = (
+            self.calming_friction_coef if calming_run else self.typical_friction_coef
+        )
+        self.vx *= friction
+        self.vy *= friction
+        # all node's x and y coordinates are adjusted by velocity_x and velocity_y
+        self.x += self.vx
+        self.y += self.vy
+
+        if not calming_run:
+            self.apply_ground()
+
+    def apply_muscles(self, beat):
+        # Measure every spring once: its delta, length, and unit direction.
+        for ax, bx, ay, by, dx, dy, length, scratch in self.families:
+            np.subtract(ax, bx, out=dx)
+            np.subtract(ay, by, out=dy)
+            np.square(dx, out=length)
+            np.square(dy, out=scratch)
+            np.add(length, scratch, out=length)
+            np.sqrt(length, out=length)
+            np.divide(dx, length, out=dx)
+            np.divide(dy, length, out=dy)
+
+        attraction = self.attraction
+        force = self.force
+        for nx, ny, length, rest_lengths, vx1, vy1, vx2, vy2 in self.springs:
+            np.subtract(rest_lengths[beat], length, out=attraction)
+            attraction *= self.spring_constants
+            np.multiply(nx, attraction, out=force)
+            vx1 += force
+            vx2 -= force
+            np.multiply(ny, attraction, out=force)
+            vy1 += force
+            vy2 -= force
+
+    def apply_ground(self):
+        # Nodes below the floor are slowed by 0.5 ** (depth * friction);
+        # nodes above it get a multiplier of exactly 1.
+        pressure = self.ground
+        np.subtract(self.y, self.floor_y, out=pressure)
+        np.maximum(pressure, 0.0, out=pressure)
+        pressure *= self.ground_friction_coef
+        np.power(0.5, pressure, out=pressure)
+
+        # clip nodes below the ground back to ground level
+        np.minimum(self.y, self.floor_y, out=self.y)
+        np.maximum(self.y, self.ceiling_y, out=self.y)
+        # any nodes touching the ground must be slowed down by ground friction.
+        self.vx *= pressure
+
+
+def set_grid_node_coords(node_coords):
+    # create grid of nodes along perfect gridlines, at rest
+    _, rows, cols, _ = node_coords.shape
+    node_coords[:] = 0
+    coordinate_grid = np.mgrid[0:rows, 0:cols]
+    coordinate_grid = np.swapaxes(np.swapaxes(coordinate_grid, 0, 1), 1, 2)
+    node_coords[:, :, :, 0:2] = coordinate_grid
+
+
+def set_lifted_node_coords(node_coords, calm_states, lift):
+    # load calm states into node_coords
+    node_coords[:] = calm_states
+    # lift the creatures above ground level
+    node_coords[:, :, :, 1] -= lift
+
+
+def set_muscles(muscles, dna, traits_per_box):
+    # muscles is (creatures, height, width, beats, traits_per_box + 1); the
+    # extra trait is the rest length of the diagonal tendons.
+    count, height, width, beats, _ = muscles.shape
+    dna_length = height * width * beats * traits_per_box
+    muscles[:, :, :, :, :traits_per_box] = (
+        1.0
+        + dna[:, :dna_length].reshape(count, height, width, beats, traits_per_box) / 3.0
+    )
+    muscles[:, :, :, :, 3] = np.sqrt(
+        np.square(muscles[:, :, :, :, 0]) + np.square(muscles[:, :, :, :, 1])
+    )
+
+
+def measure_step_allocations(engine, beat, calming_run, frames=10):
+    # Returns (bytes left allocated, peak scratch bytes) per bound step, as
+    # seen by tracemalloc. A temporary array of any size shows up in the peak.
+    tracemalloc.start()
+    engine.step(beat, calming_run)
+    tracemalloc.reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    for _ in range(frames):
+        engine.step(beat, calming_run)
+    end, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (end - start) // frames, peak - start
@@ -0,0 +1,170 @@
+import numpy as np
+
+
+class Population:
+    # Every creature that has ever lived, stored column by column: each
+    # attribute is one (generation, creature) matrix, so a generation's DNA
+    # or calm states are a single slice. Rows are allocated in blocks that
+    # double in size, so adding a generation is usually just a counter bump.
+    def __init__(self, creature_count, trait_count, node_shape):
+        self.creature_count = creature_count
+        self.generation_count = 0
+        self.capacity = 0
+        self.columns = {
+            # name: (per-creature shape, dtype, fill value for a new generation)
+            "dna": ((trait_count,), np.float64, 0.0),
+            "calm_states": (node_shape, np.float64, 0.0),
+            "calmed": ((), bool, False),
+            "fitness": ((), np.float64, np.nan),
+            "ranks": ((), int, -1),
+            "species": ((), int, -1),
+            "living": ((), bool, True),
+            "codon_with_change": ((), int, -1),
+        }
+        for name, (shape, dtype, fill) in self.columns.items():
+            setattr(self, name, np.full((0, creature_count) + shape, fill, dtype))
+
+    def grow(self, capacity):
+        for name, (shape, dtype, fill) in self.columns.items():
+            column = np.full((capacity, self.creature_count) + shape, fill, dtype)
+            column[: self.generation_count] = getattr(self, name)[
+                : self.generation_count
+            ]
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def add_generation(self):
+        if self.generation_count == self.capacity:
+            self.grow(max(1, 2 * self.capacity))
+        gen = self.generation_count
+        self.generation_count += 1
+        return gen
+
+    def get_columns(self):
+        return {
+            name: getattr(self, name)[: self.generation_count] for name in self.columns
+        }
+
+    def load_columns(self, columns):
+        self.generation_count = len(columns["dna"])
+        self.capacity = self.generation_count
+        for name in self.columns:
+            setattr(self, name, np.array(columns[name]))
+
+    def set_creature(self, gen, c, dna, species):
+        self.dna[gen, c] = dna
+        self.species[gen, c] = species
+
+
+class History:
+    # One row per finished generation, appended in place. Like the
+    # population's columns, the buffer doubles when it fills up, so a long
+    # run never copies its whole history each generation; get() is a view.
+    def __init__(self, row_shape, dtype):
+        self.buffer = np.zeros((0,) + row_shape, dtype)
+        self.length = 0
+
+    def append(self, row):
+        self.extend(np.expand_dims(row, 0))
+
+    def extend(self, rows):
+        length = self.length + len(rows)
+        if length > len(self.buffer):
+            capacity = max(1, len(self.buffer))
+            while capacity < length:
+                capacity *= 2
+            buffer = np.zeros((capacity,) + self.buffer.shape[1:], self.buffer.dtype)
+            buffer[: self.length] = self.buffer[: self.length]
+            self.buffer = buffer
+        self.buffer[self.length : length] = rows
+        self.length = length
+
+    def get(self):
+        return self.buffer[: self.length]
+
+    def load(self, rows):
+        self.buffer = np.array(rows, dtype=self.buffer.dtype)
+        self.length = len(rows)
+
+
+class SpeciesPopulations:
+    # The species alive in each generation, stored sparsely: one entry per
+    # (generation, species), with each generation's entries in species ID
+    # order and found through offsets, like a CSR matrix. An entry holds the
+    # species' population and where its band of the stacked chart ends.
+    # Each species also keeps the list of its own entries, over time.
+    def __init__(self):
+        self.species = History((), int)
+        self.pops = History((), int)
+        self.ends = History((), int)
+        self.offsets = History((), int)
+        self.offsets.append(0)
+        self.entries_by_species = []
+
+    def __len__(self):
+        return self.offsets.length - 1
+
+    def append(self, species, pops):
+        entries = np.arange(self.species.length, self.species.length + len(species))
+        self.species.extend(species)
+        self.pops.extend(pops)
+        self.ends.extend(np.cumsum(pops))
+        self.offsets.append(self.species.length)
+        for s, entry in zip(species.tolist(), entries.tolist()):
+            while len(self.entries_by_species) <= s:
+                self.entries_by_species.append([])
+            self.entries_by_species[s].append(entry)
+
+    def get_generation(self, gen):
+        # (species, populations, band starts, band ends) of a generation
+        start, end = self.offsets.buffer[gen : gen + 2]
+        pops = self.pops.buffer[start:end]
+        ends = self.ends.buffer[start:end]
+        return self.species.buffer[start:end], pops, ends - pops, ends
+
+    def get_population(self, gen, s):
+        species, pops, _, _ = self.get_generation(gen)
+        i = np.searchsorted(species, s)
+        return int(pops[i]) if i < len(species) and species[i] == s else 0
+
+    def get_top_species(self, gen):
+        # the most populous species, the last of them in the chart on a tie
+        species, pops, _, _ = self.get_generation(gen)
+        return int(species[len(pops) - 1 - np.argmax(pops[::-1])])
+
+    def get_species_history(self, s):
+        # the generations a species was alive in and its population in each
+        entries = np.array(
+            self.entries_by_species[s] if s < len(self.entries_by_species) else [],
+            dtype=int,
+        )
+        gens = np.searchsorted(self.offsets.get(), entries, side="right") - 1
+        return gens, self.pops.buffer[entries]
+
+    def get_rows(self, first_generation=0):
+        # one (generation, species, population, start, end) row per entry, of
+        # the generations from first_generation on
+        offsets = self.offsets.get()[first_generation:]
+        gens = np.repeat(np.arange(first_generation, len(self)), np.diff(offsets))
+        start = offsets[0]
+        pops = self.pops.get()[start:]
+        ends = self.ends.get()[start:]
+        return np.stack(
+            [gens, self.species.get()[start:], pops, ends - pops, ends], axis=1
+        )
+
+    def load_rows(self, rows, generation_count):
+        rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+        self.species.load(rows[:, 1])
+        self.pops.load(rows[:, 2])
+        self.ends.load(rows[:, 4])
+        self.offsets.load(
+            np.concatenate(
+                [[0], np.cumsum(np.bincount(rows[:, 0], minlength=generation_count))]
+            )
+        )
+        self.entries_by_species = []
+        for entry, s in enumerate(rows[:, 1].tolist()):
+            while len(self.entries_by_species) <= s:
+                self.entries_by_species.append([])
+            self.entries_by_species[s].append(entry)
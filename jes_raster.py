@@ -0,0 +1,162 @@
+import numpy as np
+import pygame
+
+# Images here keep each pixel as B, G, R, A bytes, the layout of pygame's own
+# SRCALPHA surfaces, so they are handed over without converting every pixel.
+BGRA = [2, 1, 0, 3]
+
+
+def get_cell_quads(node_states, transform):
+    # (..., width + 1, height + 1, >=2) node coordinates to the pixel corners
+    # of every cell, (..., width * height, 4, 2) with cells in x * height + y
+    # order and corners (x, y), (x + 1, y), (x + 1, y + 1), (x, y + 1)
+    tx, ty, s = transform
+    nodes = node_states[..., :2]
+    quads = np.stack(
+        [
+            nodes[..., :-1, :-1, :],
+            nodes[..., 1:, :-1, :],
+            nodes[..., 1:, 1:, :],
+            nodes[..., :-1, 1:, :],
+        ],
+        axis=-2,
+    )
+    quads = quads.reshape(quads.shape[:-4] + (-1, 4, 2)) * s
+    return quads + np.array([tx, ty])
+
+
+def rasterize_quads(shape, quads, colors, background):
+    # Fills (count, cells, 4, 2) quads of (count, cells, 4) RGBA colors into
+    # new (count, height, width, 4) BGRA images of a solid background.
+    # Like drawing the cells onto a surface and blitting it over the
+    # background, a cell paints over earlier ones and the result is alpha-
+    # blended, so each cell's color only has to be blended once.
+    count, height, width = shape
+    cells = quads.shape[1]
+    quads = quads.reshape((-1, 4, 2))
+    background = np.array(tuple(pygame.Color(background)), np.uint8)
+    colors = blend(
+        np.broadcast_to(background, (len(quads), 4)),
+        np.asarray(colors).reshape((-1, 4)).astype(np.uint8),
+    )
+    colors = np.ascontiguousarray(colors[:, BGRA])
+    background = background[BGRA]
+
+    # A row of pixel centers is inside a quad between pairs of the sorted
+    # x's where it crosses the quad's edges (even-odd, so a folded cell
+    # still fills), so only covered pixels are ever visited.
+    top = np.clip(np.ceil(quads[:, :, 1].min(axis=1) - 0.5), 0, height)
+    bottom = np.clip(np.ceil(quads[:, :, 1].max(axis=1) - 0.5), 0, height)
+    rows = top[:, None] + np.arange((bottom - top).max(initial=0))
+    center_y = rows + 0.5
+    crossings = []
+    for k in range(4):
+        ax, ay = quads[:, k, 0, None], quads[:, k, 1, None]
+        bx, by = quads[:, (k + 1) % 4, 0, None], quads[:, (k + 1) % 4, 1, None]
+        crosses = (ay > center_y) != (by > center_y)
+        dy = np.where(crosses, by - ay, 1.0)
+        crossing_x = ax + (center_y - ay) * (bx - ax) / dy
+        crossings.append(np.where(crosses, crossing_x, np.inf))
+    # a sorting network, much faster than sorting an axis of 4
+    for i, j in [(0, 1), (2, 3), (0, 2), (1, 3), (1, 2)]:
+        crossings[i], crossings[j] = (
+            np.minimum(crossings[i], crossings[j]),
+            np.maximum(crossings[i], crossings[j]),
+        )
+    spans = np.clip(np.ceil(np.stack(crossings, axis=2) - 0.5), 0, width)
+    spans = spans.astype(int).reshape(rows.shape + (2, 2))
+    spans[rows >= bottom[:, None]] = 0
+    lengths = (spans[..., 1] - spans[..., 0]).ravel()
+
+    # the index of every covered pixel, and the last quad to cover each one
+    image_rows = np.repeat(np.arange(count), cells)[:, None] * height + rows
+    span_starts = image_rows.astype(int)[:, :, None] * width + spans[..., 0]
+    span_quads = np.repeat(np.arange(len(quads), dtype=np.int32), spans[0].size // 2)
+    pixels = np.repeat(span_starts.ravel() - np.cumsum(lengths) + lengths, lengths)
+    pixels += np.arange(len(pixels))
+    winners = np.full(count * height * width, -1, np.int32)
+    np.maximum.at(winners, pixels, np.repeat(span_quads, lengths))
+
+    # whole pixels are written as uint32s, which is much faster than rows of 4
+    images = np.empty((count, height, width, 4), np.uint8)
+    pixel_view = images.reshape(-1).view(np.uint32)
+    pixel_view[:] = background.view(np.uint32)[0]
+    covered = np.flatnonzero(winners >= 0)
+    pixel_view[covered] = colors.view(np.uint32).ravel()[winners[covered]]
+    return images
+
+
+def blend(destination_pixels, source_pixels):
+    # (n, 4) RGBA source pixels over destination ones, with the same integer
+    # math as blitting an SRCALPHA surface
+    source = source_pixels[:, :3].astype(int)
+    source_alpha = source_pixels[:, 3:].astype(int)
+    destination = destination_pixels[:, :3].astype(int)
+    destination_alpha = destination_pixels[:, 3:].astype(int)
+    opaque = destination_alpha > 0
+    pixels = np.empty(destination_pixels.shape, np.uint8)
+    pixels[:, :3] = np.where(
+        opaque,
+        (((source - destination) * source_alpha + source) >> 8) + destination,
+        source,
+    )
+    pixels[:, 3:] = np.where(
+        opaque,
+        source_alpha + destination_alpha - source_alpha * destination_alpha // 255,
+        source_alpha,
+    )
+    return pixels
+
+
+def fill_circles(images, center, radius, colors):
+    # one opaque circle at the same place on every image, each in its color
+    height, width = images.shape[1:3]
+    x = np.arange(width) + 0.5 - center[0]
+    y = np.arange(height)[:, None] + 0.5 - center[1]
+    inside = x**2 + y**2 <= radius**2
+    images[:, inside, :3] = np.asarray(colors)[:, None, BGRA[:3]]
+    images[:, inside, 3] = 255
+    return images
+
+
+def to_surface(image):
+    # A (height, width, 4) BGRA image as a pygame surface of its own. A
+    # cropped image is made contiguous first, since tobytes() copies a
+    # strided array one element at a time.
+    height, width = image.shape[:2]
+    image = np.ascontiguousarray(image)
+    return pygame.image.frombytes(image.tobytes(), (width, height), "BGRA")
+
+
+def draw_cell_layers(sizes, quads, colors):
+    # Rasterizes the cells of many creatures in one batch, each creature's
+    # (cells, 4, 2) quads bound for a surface of the given size. Each comes
+    # back as a transparent layer just big enough to hold its cells and the
+    # place to blit it, so a big movie screen doesn't need a full-size
+    # layer; a creature that is entirely off its surface gets an empty one.
+    boxes = []
+    for (width, height), creature_quads in zip(sizes, quads):
+        left, top = np.floor(creature_quads.reshape((-1, 2)).min(axis=0))
+        right, bottom = np.ceil(creature_quads.reshape((-1, 2)).max(axis=0))
+        left, top = int(max(left, 0)), int(max(top, 0))
+        right, bottom = int(min(right, width)), int(min(bottom, height))
+        boxes.append((left, top, max(right, left), max(bottom, top)))
+    boxes = np.array(boxes, dtype=int).reshape((-1, 4))
+    layers = rasterize_quads(
+        (
+            len(boxes),
+            (boxes[:, 3] - boxes[:, 1]).max(initial=0),
+            (boxes[:, 2] - boxes[:, 0]).max(initial=0),
+        ),
+        np.array(quads) - boxes[:, None, None, :2],
+        np.array(colors),
+        (0, 0, 0, 0),
+    )
+    cell_layers = []
+    for layer, (left, top, right, bottom) in zip(layers, boxes.tolist()):
+        if right == left or bottom == top:
+            layer = pygame.Surface((0, 0), pygame.SRCALPHA, 32)
+        else:
+            layer = to_surface(layer[: bottom - top, : right - left])
+        cell_layers.append((layer, (left, top)))
+    return cell_layers
@@ -155,7 +155,7 @@ def draw_species_circle(
     display_centered_text(screen, name, cx, cy - 22, (0, 0, 0), font)
 
     creature = sim.get_create_with_id(info.representatives[2])
-    tiny_icon = pygame.transform.scale(creature.icons[0], (50, 50))
+    tiny_icon = pygame.transform.scale(creature.get_icon(0), (50, 50))
     screen.blit(tiny_icon, (cx - 25, cy - 11))
 
     if should_draw_arrow:
@@ -1,11 +1,23 @@
+import threading
 import time
-import random
 
 import numpy as np
-from utils import apply_muscles
 from jes_creature import Creature
+from jes_population import History, Population, SpeciesPopulations
+from jes_physics import (
+    PhysicsEngine,
+    set_grid_node_coords,
+    set_lifted_node_coords,
+)
+from jes_parallel import ShardedEvaluator
+from jes_fitness_cache import FitnessCache
+from jes_muscle_cache import MuscleCache
+from jes_movies import MovieBatch
+from jes_checkpoint import Checkpointer, restore_checkpoint
+from jes_trajectories import TrajectoryStore
 from jes_species_info import SpeciesInfo
 from jes_dataviz import draw_all_graphs
+from jes_background import BackgroundGenerations
 
 
 class Simulation:
@@ -31,7 +43,21 @@ class Simulation:
         mutation_rate,
         big_mutation_rate,
         units_per_meter,
+        worker_count=1,
+        fitness_cache_size=None,
+        calm_tolerance=None,
+        checkpoint_path=None,
+        checkpoint_every=10,
+        trajectory_slots=0,
+        trajectory_decimation=1,
+        trajectory_subjects=("previews", "prominent"),
+        seed=None,
     ):
+        if creature_count <= 0 or creature_count % 2 != 0:
+            # every creature is bred in a pair, the i-th best with the i-th worst
+            raise ValueError(
+                f"creature_count must be a positive even number, got {creature_count}"
+            )
         self.creature_count = creature_count
         self.species_count = creature_count
         self.stabilization_time = stabilization_time
@@ -61,6 +87,8 @@ class Simulation:
 
         self.mutation_rate = mutation_rate
         self.big_mutation_rate = big_mutation_rate
+        # every random draw of the evolution itself comes from here
+        self.rng = np.random.default_rng(seed)
 
         # what proportion of the population does a species need to get a label?
         self.s_visible = 0.05
@@ -69,20 +97,128 @@ class Simulation:
         # change this if you want to change the resolution of the percentile-tracking
         self.percentile_base = 100
         self.units_per_meter = units_per_meter
-        self.creatures = None
-        self.rankings = np.zeros((0, self.creature_count), dtype=int)
-        self.percentiles = np.zeros((0, self.percentile_base + 1))
-        self.species_pops = []
+        self.population = Population(
+            self.creature_count,
+            self.trait_count,
+            (self.creature_height + 1, self.creature_width + 1, self.node_coord_size),
+        )
+        self.ranking_history = History((self.creature_count,), int)
+        self.percentile_history = History((self.percentile_base + 1,), np.float64)
+        self.species_pops = SpeciesPopulations()
         self.species_info = []
         self.prominent_species = []
         self.ui = None
         self.last_gen_run_time = -1
+        # {generation: {stage: (start, end)}} for the last few generations
+        self.stage_times = {}
+
+        # If set, creatures whose kinetic energy falls below this leave the
+        # calming run early. calm_frames_saved records, per generation, how
+        # many creature-frames of calming were skipped that way.
+        self.calm_tolerance = calm_tolerance
+        self.calm_frames_saved = []
+
+        self.physics_params = {
+            "creature_dimensions": self.creature_dimensions,
+            "beat_time": self.beat_time,
+            "beats_per_cycle": self.beats_per_cycle,
+            "y_clips": self.y_clips,
+            "ground_friction_coef": self.ground_friction_coef,
+            "gravity_acceleration_coef": self.gravity_acceleration_coef,
+            "calming_friction_coef": self.calming_friction_coef,
+            "typical_friction_coef": self.typical_friction_coef,
+            "muscle_coef": self.muscle_coef,
+        }
+        # One engine serves the calming run and the trial; its scratch
+        # buffers are sized to the largest batch it has seen. Movies get an
+        # engine of their own, so they can play while a generation runs.
+        self.physics = PhysicsEngine(**self.physics_params)
+        self.physics.reserve(self.creature_count)
+        self.movie_physics = PhysicsEngine(**self.physics_params)
+        self.movies = MovieBatch(self)
+        # Muscle tensors of the last few generations; see get_muscle_array.
+        self.muscle_cache = MuscleCache(
+            4,
+            (
+                self.creature_height,
+                self.creature_width,
+                self.beats_per_cycle,
+                self.traits_per_box + 1,
+            ),
+            self.traits_per_box,
+        )
+
+        # Generations can run on a background thread (see check_alap). It
+        # holds the lock while it changes what the UI reads; the UI holds it
+        # while handling events and drawing a frame.
+        self.lock = threading.RLock()
+        self.background = BackgroundGenerations(self)
+
+        # With more than one worker, the calming run and the trial are split
+        # into shards of the population and run in a process pool.
+        self.worker_count = worker_count
+        self.evaluator = None
+        if self.worker_count > 1:
+            self.evaluator = ShardedEvaluator(self, self.worker_count)
+
+        # Calm states and trial scores of genomes we've already simulated.
+        # By default it holds two generations' worth, enough for every clone
+        # to find its parent; 0 turns it off.
+        if fitness_cache_size is None:
+            fitness_cache_size = 2 * self.creature_count
+        self.fitness_cache = None
+        if fitness_cache_size > 0:
+            self.fitness_cache = FitnessCache(
+                fitness_cache_size,
+                repr(
+                    (
+                        sorted(self.physics_params.items()),
+                        self.stabilization_time,
+                        self.trial_time,
+                        self.traits_per_box,
+                        self.calm_tolerance,
+                    )
+                ),
+            )
+
+        # Every checkpoint_every generations (and on close) the whole run is
+        # written to checkpoint_path in the background.
+        self.checkpointer = None
+        self.checkpoint_every = checkpoint_every
+        if checkpoint_path is not None:
+            self.checkpointer = Checkpointer(checkpoint_path)
+
+        # With trajectory_slots > 0, the trials of the creatures movies are
+        # likely to show are recorded (see get_movie_subset), and those movies
+        # replay the recording instead of running the physics. The subjects
+        # are any of "previews", "prominent" and "all".
+        unknown = set(trajectory_subjects) - {"previews", "prominent", "all"}
+        if unknown:
+            raise ValueError(f"unknown trajectory subjects: {sorted(unknown)}")
+        self.trajectory_subjects = set(trajectory_subjects)
+        self.trajectories = None
+        if trajectory_slots > 0:
+            self.trajectories = TrajectoryStore(
+                trajectory_slots,
+                self.trial_time,
+                (self.creature_height + 1, self.creature_width + 1),
+                trajectory_decimation,
+            )
+
+    # Views of the history so far: row g belongs to generation g.
+    @property
+    def rankings(self):
+        return self.ranking_history.get()
+
+    @property
+    def percentiles(self):
+        return self.percentile_history.get()
 
     def initialize_universe(self):
-        self.creatures = [[None] * self.creature_count]
+        self.population.add_generation()
         for c in range(self.creature_count):
-            self.creatures[0][c] = self.create_new_creature(c)
-            self.species_info.append(SpeciesInfo(self, self.creatures[0][c], None))
+            self.create_new_creature(c)
+            self.species_info.append(SpeciesInfo(self, self.get_creature(0, c), None))
 
         # We want to make sure that all creatures, even in their
         # initial state, are in calm equilibrium. They shouldn't
@@ -90,273 +226,448 @@ class Simulation:
         # Calm the creatures down so no potential energy is stored
         self.get_calm_states(0, 0, self.creature_count, self.stabilization_time)
 
-        for c in range(self.creature_count):
-            for i in range(2):
-                self.creatures[0][c].icons[i] = self.creatures[0][c].draw_icon(
-                    self.ui.icon_dimension[i], self.ui.mosaic_color, self.beat_fade_time
-                )
+        # without a UI attached (headless runs) nothing is ever drawn
+        if self.ui is not None:
+            self.ui.draw_creature_mosaic(0)
 
-        self.ui.draw_creature_mosaic(0)
+    def resume_universe(self, checkpoint):
+        restore_checkpoint(self, checkpoint)
+        if self.ui is not None:
+            gen = self.population.generation_count - 1
+            if gen > 0:
+                draw_all_graphs(self, self.ui)
+            self.ui.generation_slider.val_max = gen
+            self.ui.generation_slider.manual_update(max(gen - 1, 0))
 
     def create_new_creature(self, id):
-        dna = np.clip(np.random.normal(0.0, 1.0, self.trait_count), -3, 3)
-        return Creature(dna, id, -1, self, self.ui)
+        dna = np.clip(self.rng.normal(0.0, 1.0, self.trait_count), -3, 3)
+        # a brand-new creature founds its own species
+        self.population.set_creature(0, id, dna, id)
+
+    def get_creature(self, gen, c):
+        return Creature(self, gen, c)
 
     def get_calm_states(self, gen, start_idx, end_idx, frame_count):
-        param = self.simulate_import(gen, start_idx, end_idx, False)
-        node_coords, _, _ = self.simulate_run(param, frame_count, True)
-        for c in range(self.creature_count):
-            self.creatures[gen][c].save_calm_state(node_coords[c])
+        indices = list(range(start_idx, end_idx))
+        keys = None
+        if self.fitness_cache is not None:
+            # clones share their parent's genome, so their calm state is
+            # already known and they are left out of the batch entirely.
+            keys = [self.get_genome_key(gen, c) for c in indices]
+            misses = []
+            for c, key in zip(indices, keys):
+                calm_state = self.fitness_cache.get_calm_state(key)
+                if calm_state is None:
+                    misses.append(c)
+                else:
+                    self.save_calm_state(gen, c, calm_state)
+            indices = misses
+        if len(indices) == 0:
+            self.calm_frames_saved.append(0)
+            return
+        node_coords, frames_saved = self.run_batch(gen, indices, frame_count, True)
+        self.calm_frames_saved.append(frames_saved)
+        self.population.calm_states[gen, indices] = node_coords[: len(indices)]
+        self.population.calmed[gen, indices] = True
+        if keys is not None:
+            for c in indices:
+                # the cache outlives the population's rows, so keep a copy
+                self.fitness_cache.put_calm_state(
+                    self.get_genome_key(gen, c),
+                    self.population.calm_states[gen, c].copy(),
+                )
 
-    def get_starting_node_coords(self, gen, start_idx, end_idx, from_calm_state):
-        count = end_idx - start_idx
+    def save_calm_state(self, gen, c, calm_state):
+        self.population.calm_states[gen, c] = calm_state
+        self.population.calmed[gen, c] = True
+
+    def get_trial_scores(self, gen):
+        final_scores = np.zeros(self.creature_count)
+        indices = list(range(self.creature_count))
+        if self.fitness_cache is not None:
+            misses = []
+            for c in indices:
+                fitness = self.fitness_cache.get_fitness(self.get_genome_key(gen, c))
+                if fitness is None:
+                    misses.append(c)
+                else:
+                    final_scores[c] = fitness
+            indices = misses
+        if len(indices) == 0:
+            return final_scores
+        scores, _ = self.run_batch(gen, indices, self.trial_time, False)
+        final_scores[indices] = scores
+        if self.fitness_cache is not None:
+            for c, score in zip(indices, scores):
+                self.fitness_cache.put_fitness(self.get_genome_key(gen, c), score)
+        return final_scores
+
+    def get_genome_key(self, gen, c):
+        return self.fitness_cache.get_key(self.population.dna[gen, c])
+
+    def run_batch(self, gen, indices, frame_count, calming_run):
+        # Calming runs return the calm node coordinates, trials return each
+        # creature's final score, in the order of indices. Both also return
+        # the number of creature-frames saved by settling early.
+        if self.evaluator is not None:
+            return self.evaluator.run(self, gen, indices, frame_count, calming_run)
+        node_coords, muscles, current_frame = self.import_batch(
+            gen, indices, not calming_run
+        )
+        frames_saved = self.physics.run(
+            node_coords,
+            muscles,
+            current_frame,
+            frame_count,
+            calming_run,
+            self.calm_tolerance,
+        )
+        if calming_run:
+            return node_coords, frames_saved
+        # find each creature's average X-coordinate
+        return node_coords[:, :, :, 0].mean(axis=(1, 2)), frames_saved
+
+    def get_dna_matrix(self, gen, indices, out=None):
+        return np.take(self.population.dna[gen], indices, axis=0, out=out)
+
+    def get_calm_state_matrix(self, gen, indices, out=None):
+        return np.take(self.population.calm_states[gen], indices, axis=0, out=out)
+
+    def get_starting_node_coords(self, gen, indices, from_calm_state):
         node_coords = np.zeros(
             (
-                count,
+                len(indices),
                 self.creature_height + 1,
                 self.creature_width + 1,
                 self.node_coord_size,
             )
         )
-        if not from_calm_state or self.creatures[gen][0].calm_state is None:
-            # create grid of nodes along perfect gridlines
-            coordinate_grid = np.mgrid[
-                0 : self.creature_width + 1, 0 : self.creature_height + 1
-            ]
-            coordinate_grid = np.swapaxes(np.swapaxes(coordinate_grid, 0, 1), 1, 2)
-            node_coords[:, :, :, 0:2] = coordinate_grid
+        if not from_calm_state or not self.population.calmed[gen, 0]:
+            set_grid_node_coords(node_coords)
         else:
-            # load calm state into node_coords
-            for c in range(start_idx, end_idx):
-                node_coords[c - start_idx, :, :, :] = self.creatures[gen][c].calm_state
-                # lift the creature above ground level
-                node_coords[c - start_idx, :, :, 1] -= self.creature_height
-        return node_coords
-
-    def get_muscle_array(self, gen, start_idx, end_idx):
-        count = end_idx - start_idx
-        # Add one trait for diagonal length.
-        muscles = np.zeros(
-            (
-                count,
+            set_lifted_node_coords(
+                node_coords,
+                self.get_calm_state_matrix(gen, indices),
                 self.creature_height,
-                self.creature_width,
-                self.beats_per_cycle,
-                self.traits_per_box + 1,
-            )
-        )
-        dna_length = (
-            self.creature_height
-            * self.creature_width
-            * self.beats_per_cycle
-            * self.traits_per_box
-        )
-        for c in range(start_idx, end_idx):
-            dna = (
-                self.creatures[gen][c]
-                .dna[0:dna_length]
-                .reshape(
-                    self.creature_height,
-                    self.creature_width,
-                    self.beats_per_cycle,
-                    self.traits_per_box,
-                )
             )
-            muscles[c - start_idx, :, :, :, : self.traits_per_box] = 1.0 + dna / 3.0
-        # Set diagonal tendons
-        muscles[:, :, :, :, 3] = np.sqrt(
-            np.square(muscles[:, :, :, :, 0]) + np.square(muscles[:, :, :, :, 1])
-        )
-        return muscles
+        return node_coords
 
-    def simulate_import(self, gen, start_idx, end_idx, from_calm_state):
-        node_coords = self.get_starting_node_coords(
-            gen, start_idx, end_idx, from_calm_state
-        )
-        muscles = self.get_muscle_array(gen, start_idx, end_idx)
+    def get_muscle_array(self, gen, indices):
+        # Slices the generation's muscle tensor, which has one extra trait
+        # for diagonal length. A whole-generation batch gets the tensor
+        # itself, so the engine can keep its rest lengths from the calming
+        # run for the trial.
+        muscles = self.muscle_cache.get_muscles(gen, self.population.dna[gen])
+        if len(indices) == self.creature_count and np.array_equal(
+            indices, np.arange(self.creature_count)
+        ):
+            return muscles
+        return np.take(muscles, indices, axis=0)
+
+    def import_batch(self, gen, indices, from_calm_state):
+        node_coords = self.get_starting_node_coords(gen, indices, from_calm_state)
+        muscles = self.get_muscle_array(gen, indices)
         current_frame = 0
         return node_coords, muscles, current_frame
 
-    def frame_to_beat(self, f):
-        return (f // self.beat_time) % self.beats_per_cycle
-
-    def frame_to_beat_fade(self, f):
-        prog = f % self.beat_time
-        return min(prog / self.beat_fade_time, 1)
-
-    def simulate_run(self, param, frame_count, calming_run):
-        node_coords, muscles, start_current_frame = param
-        friction = (
-            self.calming_friction_coef if calming_run else self.typical_friction_coef
+    def simulate_import(self, gen, start_idx, end_idx, from_calm_state):
+        return self.import_batch(gen, range(start_idx, end_idx), from_calm_state)
+
+    def record_trajectories(self, gen, indices):
+        indices = [
+            c for c in indices if gen * self.creature_count + c not in self.trajectories
+        ]
+        if len(indices) == 0:
+            return
+        node_coords, muscles, current_frame = self.import_batch(gen, indices, True)
+        recording = self.trajectories.get_recording_buffer(len(indices))
+        self.physics.run(
+            node_coords,
+            muscles,
+            current_frame,
+            self.trial_time,
+            False,
+            record=recording,
+            record_every=self.trajectories.decimation,
         )
-        ceiling_y = self.y_clips[0]
-        floor_y = self.y_clips[1]
-
-        for f in range(frame_count):
-            current_frame = start_current_frame + f
-            beat = 0
-
-            if not calming_run:
-                beat = self.frame_to_beat(current_frame)
-                # decrease y-velo (3rd node coords) by G
-                node_coords[:, :, :, 3] += self.gravity_acceleration_coef
-
-            apply_muscles(node_coords, muscles[:, :, :, beat, :], self.muscle_coef)
-            node_coords[:, :, :, 2:4] *= friction
-            # all node's x and y coordinates are adjusted by velocity_x and velocity_y
-            node_coords[:, :, :, 0:2] += node_coords[:, :, :, 2:4]
-
-            # dealing with collision with the ground.
-            if not calming_run:
-                nodes_touching_ground = np.ma.masked_where(
-                    node_coords[:, :, :, 1] >= floor_y, node_coords[:, :, :, 1]
-                )
-                # mask that only countains 1's where nodes touch the floor
-                m = nodes_touching_ground.mask.astype(float)
-                pressure = node_coords[:, :, :, 1] - floor_y
-                ground_friction_multiplier = 0.5 ** (
-                    m * pressure * self.ground_friction_coef
-                )
-
-                # clip nodes below the ground back to ground level
-                node_coords[:, :, :, 1] = np.clip(
-                    node_coords[:, :, :, 1], ceiling_y, floor_y
-                )
-                # any nodes touching the ground must be slowed down by ground friction.
-                node_coords[:, :, :, 2] *= ground_friction_multiplier
-
-        # If it's a calming run, then take the average location of all nodes to center it at the origin.
-        if calming_run:
-            node_coords[:, :, :, 0] -= np.mean(
-                node_coords[:, :, :, 0], axis=(1, 2), keepdims=True
+        with self.lock:
+            self.trajectories.put(
+                [gen * self.creature_count + c for c in indices], recording
             )
-        return node_coords, muscles, start_current_frame + frame_count
 
-    def do_species_info(self, new_species_populations, best_of_each_species):
-        new_species_populations = dict(sorted(new_species_populations.items()))
-        running = 0
-        for sp, val in new_species_populations.items():
-            pop = val[0]
-            val[1] = running
-            val[2] = running + pop
-            running += pop
+    def get_movie_subset(self, gen, current_rankings):
+        # The creatures of this generation whose trials are recorded: the
+        # best, median and worst ("previews"), the representatives of
+        # prominent species, the ones with a circle in the genealogy
+        # ("prominent"), or every creature ("all"). The default subjects
+        # take about a tenth of the trial's time to record.
+        if "all" in self.trajectory_subjects:
+            return list(range(self.creature_count))
+        ids = set()
+        if "previews" in self.trajectory_subjects:
+            ids.update(
+                gen * self.creature_count + int(current_rankings[rank])
+                for rank in (0, self.creature_count // 2, self.creature_count - 1)
+            )
+        if "prominent" in self.trajectory_subjects:
+            for level in self.prominent_species:
+                for s in level:
+                    ids.update(self.species_info[s].representatives.tolist())
+        return sorted(
+            _id % self.creature_count
+            for _id in ids
+            if _id // self.creature_count == gen
+        )
 
+    def import_movie(self, gen, c):
+        recording = None
+        if self.trajectories is not None:
+            recording = self.trajectories.get(gen * self.creature_count + c)
+        if recording is None:
+            return self.simulate_import(gen, c, c + 1, True)
+        # a recorded movie has no muscles; it is only ever played back
+        return recording, None, 0
+
+    def do_species_info(self, species, pops, best):
+        for sp, pop, best_id in zip(species.tolist(), pops.tolist(), best.tolist()):
             info = self.species_info[sp]
             # most-recent representative
-            info.representatives[3] = best_of_each_species[sp]
+            info.representatives[3] = best_id
             if pop > info.apex_pop:  # This species reached its highest population
                 info.apex_pop = pop
                 # apex representative
-                info.representatives[2] = best_of_each_species[sp]
+                info.representatives[2] = best_id
 
             # prominent threshold
             if pop >= self.creature_count * self.s_notable and not info.prominent:
                 info.become_prominent()
 
     def check_alap(self):
+        # Called by the UI thread every frame. When the background thread has
+        # finished a generation, the next one is started before this one is
+        # shown, so drawing its graphs and icons overlaps the next trial.
+        finished = self.background.collect()
+        gen = self.population.generation_count - 2
         if self.ui.alap_button.setting == 1:  # We're already ALAP-ing!
-            self.simulate_generation(self.ui.do_generation_button)
+            self.background.start()
+        if finished:
+            self.show_generation(gen)
+
+    def request_generation(self, _button):
+        self.background.start()
 
     def simulate_generation(self, _button):
+        self.run_generation()
+        if self.ui is not None:
+            self.show_generation(self.population.generation_count - 2)
+
+    def run_generation(self):
         # calculates how long each generation takes to run
         generation_start_time = time.monotonic()
 
-        gen = len(self.creatures) - 1
-        creature_state = self.simulate_import(gen, 0, self.creature_count, True)
-        node_coords, _, _ = self.simulate_run(creature_state, self.trial_time, False)
-        # find each creature's average X-coordinate
-        final_scores = node_coords[:, :, :, 0].mean(axis=(1, 2))
+        population = self.population
+        gen = population.generation_count - 1
+        final_scores = self.get_trial_scores(gen)
+        t = self.time_stage(gen, "trial", generation_start_time)
+        with self.lock:
+            movie_subset = self.apply_trial_scores(gen, final_scores)
+        t = self.time_stage(gen, "breed", t)
+
+        if movie_subset is not None:
+            self.record_trajectories(gen, movie_subset)
+            t = self.time_stage(gen, "record", t)
+
+        # Calm the creatures down so no potential energy is stored
+        self.get_calm_states(gen + 1, 0, self.creature_count, self.stabilization_time)
+        t = self.time_stage(gen, "calm", t)
+        self.last_gen_run_time = t - generation_start_time
+
+        if self.checkpointer is not None and (gen + 1) % self.checkpoint_every == 0:
+            with self.lock:
+                self.checkpointer.save(self)
+            self.time_stage(gen, "checkpoint", t)
+
+    def time_stage(self, gen, stage, start):
+        end = time.monotonic()
+        if gen not in self.stage_times:
+            self.stage_times[gen] = {}
+            self.stage_times.pop(gen - 3, None)
+        self.stage_times[gen][stage] = (start, end)
+        return end
+
+    def get_stage_report(self, gen):
+        # How long each stage of generation gen took. Showing a generation
+        # can overlap the next one's stages; how much did is reported too.
+        stages = self.stage_times.get(gen, {}).copy()
+        parts = []
+        for stage, (start, end) in stages.items():
+            part = f"{stage} {end - start:.2f}s"
+            if stage == "calm" and self.calm_tolerance is not None:
+                # generation gen's calm stage calms generation gen + 1
+                saved = self.calm_frames_saved[gen + 1]
+                part += f" ({saved} creature-frames skipped)"
+            parts.append(part)
+        following = self.stage_times.get(gen + 1, {}).copy()
+        if "show" in stages and len(following) > 0:
+            show_start, show_end = stages["show"]
+            next_start = min(start for start, _ in following.values())
+            overlap = max(0.0, show_end - max(show_start, next_start))
+            parts[-1] += f" ({overlap:.2f}s overlapped with the next generation)"
+        return ", ".join(parts)
+
+    def apply_trial_scores(self, gen, final_scores):
+        # Ranks generation gen, breeds generation gen + 1 and records the
+        # history; returns the creatures whose trials should be recorded.
+        population = self.population
 
         # Tallying up all the data
         current_rankings = np.flip(np.argsort(final_scores), axis=0)
-        new_percentiles = np.zeros((self.percentile_base + 1))
-        new_species_populations = {}
-        best_of_each_species = {}
-        for rank in range(self.creature_count):
-            c = current_rankings[rank]
-            self.creatures[gen][c].fitness = final_scores[c]
-            self.creatures[gen][c].rank = rank
-
-            species = self.creatures[gen][c].species
-            if species in new_species_populations:
-                new_species_populations[species][0] += 1
-            else:
-                new_species_populations[species] = [1, None, None]
-            if species not in best_of_each_species:
-                best_of_each_species[species] = self.creatures[gen][c].id
-        self.do_species_info(new_species_populations, best_of_each_species)
-
-        for percentile in range(self.percentile_base + 1):
-            rank = min(
-                int(self.creature_count * percentile / self.percentile_base),
-                self.creature_count - 1,
-            )
-            c = current_rankings[rank]
-            new_percentiles[percentile] = self.creatures[gen][c].fitness
-
-        next_creatures = [None] * self.creature_count
-        for rank in range(self.creature_count // 2):
-            winner = current_rankings[rank]
-            loser = current_rankings[(self.creature_count - 1) - rank]
-            if random.uniform(0, 1) < rank / self.creature_count:
-                loser, winner = winner, loser
-            next_creatures[winner] = None
-            # A 1st place finisher is guaranteed to make a clone, but as we get
-            # closer to the middle the odds get more likely we just get 2 mutants.
-            if random.uniform(0, 1) < rank / self.creature_count * 2.0:
-                next_creatures[winner] = self.mutate(
-                    self.creatures[gen][winner],
-                    (gen + 1) * self.creature_count + winner,
-                )
-            else:
-                next_creatures[winner] = self.clone(
-                    self.creatures[gen][winner],
-                    (gen + 1) * self.creature_count + winner,
-                )
-            next_creatures[loser] = self.mutate(
-                self.creatures[gen][winner], (gen + 1) * self.creature_count + loser
-            )
-            self.creatures[gen][loser].living = False
+        ranks = np.arange(self.creature_count)
+        population.fitness[gen] = final_scores
+        population.ranks[gen, current_rankings] = ranks
+
+        # Species in ID order with their population, their band of the
+        # stacked species chart, and their best (first-ranked) creature.
+        ranked_species = population.species[gen, current_rankings]
+        species, first_ranks, pops = np.unique(
+            ranked_species, return_index=True, return_counts=True
+        )
+        best = gen * self.creature_count + current_rankings[first_ranks]
+        self.do_species_info(species, pops, best)
 
-        self.creatures.append(next_creatures)
-        self.rankings = np.append(
-            self.rankings, current_rankings.reshape((1, self.creature_count)), axis=0
+        percentile_ranks = np.minimum(
+            (
+                self.creature_count
+                * np.arange(self.percentile_base + 1)
+                / self.percentile_base
+            ).astype(int),
+            self.creature_count - 1,
         )
-        self.percentiles = np.append(
-            self.percentiles,
-            new_percentiles.reshape((1, self.percentile_base + 1)),
-            axis=0,
+        new_percentiles = final_scores[current_rankings[percentile_ranks]]
+
+        # Pair the i-th best with the i-th worst. The winner of each pair
+        # (usually the better one, but the odds even out towards the middle)
+        # survives, the loser is killed.
+        pair_ranks = ranks[: self.creature_count // 2]
+        winners = current_rankings[pair_ranks]
+        losers = current_rankings[(self.creature_count - 1) - pair_ranks]
+        swap = (
+            self.rng.uniform(0, 1, len(pair_ranks)) < pair_ranks / self.creature_count
         )
-        self.species_pops.append(new_species_populations)
-
+        winners, losers = np.where(swap, losers, winners), np.where(
+            swap, winners, losers
+        )
+        # A 1st place finisher is guaranteed to make a clone, but as we get
+        # closer to the middle the odds get more likely we just get 2 mutants.
+        mutate_winners = (
+            self.rng.uniform(0, 1, len(pair_ranks))
+            < pair_ranks / self.creature_count * 2.0
+        )
+        population.living[gen, losers] = False
+
+        population.add_generation()
+        self.clone(gen, winners[~mutate_winners])
+        # each pair's mutants, winner's slot first, in pair order
+        parents = np.stack([winners, winners], axis=1)
+        children = np.stack([winners, losers], axis=1)
+        mutants = np.stack([mutate_winners, np.ones_like(mutate_winners)], axis=1)
+        self.mutate(gen, parents[mutants], children[mutants])
+
+        self.ranking_history.append(current_rankings)
+        self.percentile_history.append(new_percentiles)
+        self.species_pops.append(species, pops)
+
+        if self.trajectories is None:
+            return None
+        return self.get_movie_subset(gen, current_rankings)
+
+    def show_generation(self, gen):
+        start = time.monotonic()
         draw_all_graphs(self, self.ui)
-
-        self.get_calm_states(gen + 1, 0, self.creature_count, self.stabilization_time)
-        # Calm the creatures down so no potential energy is stored
-        for c in range(self.creature_count):
-            for i in range(2):
-                self.creatures[gen + 1][c].icons[i] = self.creatures[gen + 1][
-                    c
-                ].draw_icon(
-                    self.ui.icon_dimension[i], self.ui.mosaic_color, self.beat_fade_time
-                )
-
         self.ui.generation_slider.val_max = gen + 1
         self.ui.generation_slider.manual_update(gen)
-        self.last_gen_run_time = time.monotonic() - generation_start_time
-
         self.ui.detect_mouse_motion()
+        self.time_stage(gen, "show", start)
 
     def get_create_with_id(self, _id):
-        return self.creatures[_id // self.creature_count][_id % self.creature_count]
-
-    def clone(self, parent, new_id):
-        return Creature(parent.dna, new_id, parent.species, self, self.ui)
-
-    def mutate(self, parent, new_id):
-        new_dna, new_species, creature_widthc = parent.get_mutated_dna(self)
-        new_creature = Creature(new_dna, new_id, new_species, self, self.ui)
-        if new_creature.species != parent.species:
-            self.species_info.append(SpeciesInfo(self, new_creature, parent))
-            new_creature.codon_with_change = creature_widthc
-        return new_creature
+        return self.get_creature(_id // self.creature_count, _id % self.creature_count)
+
+    def clone(self, gen, indices):
+        # a clone takes its parent's slot in the next generation
+        population = self.population
+        population.dna[gen + 1, indices] = population.dna[gen, indices]
+        population.species[gen + 1, indices] = population.species[gen, indices]
+
+    def mutate(self, gen, parents, children):
+        population = self.population
+        dna = population.dna[gen, parents]
+        mutation = np.clip(self.rng.normal(0.0, 1.0, dna.shape), -99, 99)
+        dna += self.mutation_rate * mutation
+        species = population.species[gen, parents]
+
+        # A big mutation founds a new species and shoves one cell's traits,
+        # at one beat, by at least 0.5 each.
+        big = np.flatnonzero(
+            self.rng.uniform(0, 1, len(parents)) < self.big_mutation_rate
+        )
+        species[big] = self.species_count + np.arange(len(big))
+        self.species_count += len(big)
+        cell_x = self.rng.integers(0, self.creature_width, len(big))
+        cell_y = self.rng.integers(0, self.creature_height, len(big))
+        cell_beat = self.rng.integers(0, self.beats_per_cycle, len(big))
+        big_mut_locs = (
+            cell_x * self.creature_height * self.beats_per_cycle
+            + cell_y * self.beats_per_cycle
+            + cell_beat
+        ) * self.traits_per_box
+        traits = big_mut_locs[:, None] + np.arange(self.traits_per_box)
+        dna[big[:, None], traits] += self.get_big_mutation_deltas(traits.shape)
+        if self.traits_per_box > 2:
+            # Cells that endure a big mutation are also required to be at
+            # least somewhat rigid, because if a cell goes from super-short
+            # to super-tall but has low rigidity the whole time, then it
+            # doesn't really matter.
+            rigidity = dna[big, traits[:, 2]]
+            dna[big, traits[:, 2]] = np.maximum(rigidity, 0.5)
+
+        population.dna[gen + 1, children] = dna
+        population.species[gen + 1, children] = species
+        population.codon_with_change[gen + 1, children[big]] = big_mut_locs
+        for parent, child in zip(parents[big].tolist(), children[big].tolist()):
+            self.species_info.append(
+                SpeciesInfo(
+                    self,
+                    self.get_creature(gen + 1, child),
+                    self.get_creature(gen, parent),
+                )
+            )
+
+    def get_big_mutation_deltas(self, shape):
+        # normal draws, redrawing any smaller than 0.5 in size until none are
+        deltas = self.rng.normal(0.0, 1.0, shape)
+        small = np.abs(deltas) < 0.5
+        while small.any():
+            deltas[small] = self.rng.normal(0.0, 1.0, np.count_nonzero(small))
+            small = np.abs(deltas) < 0.5
+        return deltas
+
+    def is_between_generations(self):
+        # every finished generation is in the history and the newest one is
+        # fully calmed, so a checkpoint taken now resumes where it left off
+        generation_count = self.population.generation_count
+        return (
+            generation_count > 0
+            and len(self.rankings) == generation_count - 1
+            and bool(self.population.calmed[generation_count - 1].all())
+        )
+
+    def close(self, save=True):
+        # save=False for a run stopped by an exception, which may have hit
+        # partway through a generation; it is left at its last checkpoint
+        self.background.wait()
+        if self.checkpointer is not None:
+            if save and self.is_between_generations():
+                self.checkpointer.save(self)
+            self.checkpointer.wait()
+        if self.evaluator is not None:
+            self.evaluator.close()
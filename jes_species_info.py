@@ -61,5 +61,4 @@ class SpeciesInfo:
     def get_performance(self, sim, index):
         gen = math.floor(self.representatives[index] // self.simulation.creature_count)
         c = self.representatives[index] % self.simulation.creature_count
-        creature = sim.creatures[gen][c]
-        return creature.fitness
+        return sim.get_creature(gen, c).fitness
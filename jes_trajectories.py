@@ -0,0 +1,40 @@
+import numpy as np
+
+
+class TrajectoryStore:
+    # Recorded trials, so movies can be replayed instead of re-simulated.
+    # Each recording holds the x and y of every node (float32) every
+    # `decimation` frames of the trial. Recordings live in a fixed ring of
+    # slots; once it is full the oldest recording is overwritten.
+    def __init__(self, slot_count, trial_time, node_shape, decimation):
+        self.decimation = decimation
+        self.frame_count = trial_time // decimation + 1
+        self.frames = np.zeros(
+            (slot_count, self.frame_count) + tuple(node_shape[:2]) + (2,),
+            dtype=np.float32,
+        )
+        self.slot_ids = np.full(slot_count, -1)
+        self.slots = {}
+        self.next_slot = 0
+
+    def __contains__(self, _id):
+        return _id in self.slots
+
+    def get(self, _id):
+        # a copy, since the slot may be reused while the movie is playing
+        slot = self.slots.get(_id)
+        return None if slot is None else self.frames[slot].copy()
+
+    def put(self, ids, recordings):
+        for _id, recording in zip(ids, recordings):
+            slot = self.slots.get(_id)
+            if slot is None:
+                slot = self.next_slot
+                self.next_slot = (self.next_slot + 1) % len(self.slot_ids)
+                self.slots.pop(self.slot_ids[slot], None)
+                self.slot_ids[slot] = _id
+                self.slots[_id] = slot
+            self.frames[slot] = recording
+
+    def get_recording_buffer(self, count):
+        return np.zeros((count,) + self.frames.shape[1:], dtype=np.float32)
@@ -7,12 +7,19 @@ import pygame
 from utils import (
     species_to_color,
     species_to_name,
+    get_species_colors,
+    clear_species_caches,
     dist_to_text,
     clamp,
     get_distance,
     array_int_multiply,
 )
-from jes_dataviz import display_all_graphs, draw_all_graphs
+from jes_dataviz import (
+    LabelChart,
+    LineGraph,
+    display_all_graphs,
+    draw_all_graphs,
+)
 from jes_shapes import (
     draw_ring_light,
     draw_x,
@@ -22,6 +29,8 @@ from jes_shapes import (
 )
 from jes_slider import Slider
 from jes_button import Button
+from jes_creature import get_cell_layers
+from jes_icon_cache import IconCache
 
 
 class UI:
@@ -38,6 +47,7 @@ class UI:
         menu_text_up,
         cm_margin1,
         cm_margin2,
+        icon_cache_bytes=64 * 2**20,
     ):
         self.slider_list = []
         self.button_list = []
@@ -54,8 +64,10 @@ class UI:
 
         self.graph_coords = graph_coords
         self.graph = pygame.Surface(self.graph_coords[2:4], pygame.SRCALPHA, 32)
+        self.line_graph = LineGraph(self.graph, [70, 0, 30, 30], self.small_font)
         self.label_coords = label_coords
         self.labels = pygame.Surface(self.label_coords[2:4], pygame.SRCALPHA, 32)
+        self.label_chart = LabelChart(self.labels, [70, 0])
         self.ancestry_tree_coords = ancestry_tree_coords
         self.gene_graph = pygame.Surface(
             self.ancestry_tree_coords[2:4], pygame.SRCALPHA, 32
@@ -82,6 +94,8 @@ class UI:
             (self.mosaic_width_creatures) / self.mosaic_dim[1] - self.cm_margin2 * 2
         )
         self.icon_dimension = ((s1, s1), (s2, s2), (s2, s2))
+        # icons are drawn when the mosaic or a species circle first shows them
+        self.icon_cache = IconCache(icon_cache_bytes)
 
         self.mosaic_visible = False
         # Creature Location Highlight.
@@ -90,9 +104,10 @@ class UI:
         # Third: rank of creature?
         self.clh = [None, None, None]
         self.creature_highlight = []
+        # Where each creature of the displayed generation sits in the mosaic.
+        self.icon_coords = {}
         self.slider_drag = None
 
-        self.visual_sim_memory = []
         self.movie_screens = []
         self.sim = None
 
@@ -108,6 +123,9 @@ class UI:
             [570, 365, 250, 250],
             [570, 625, 250, 250],
         ]
+        # the best, median and worst creature previews, and what they show
+        self.previews = []
+        self.preview_key = None
         self.salt = str(random.uniform(0, 1))
         # special-case colors: species colored by the user, not RNG
         self.overridden_colors = {}
@@ -183,7 +201,7 @@ class UI:
             self, button_coords[3], ["Watch sample", "Stop sample"], self.start_sample
         )
         self.do_generation_button = Button(
-            self, button_coords[4], ["Do a generation"], self.sim.simulate_generation
+            self, button_coords[4], ["Do a generation"], self.sim.request_generation
         )
         self.alap_button = Button(
             self, button_coords[5], ["Turn on ALAP", "Turn off ALAP"], self.do_nothing
@@ -260,28 +278,25 @@ class UI:
                 self.clear_movies()
             elif self.clh[0] == 2:  # a species was highlighted
                 info = self.sim.species_info[self.clh[1]]
-                self.visual_sim_memory = []
+                self.sim.movies.clear()
                 self.creature_highlight = []
                 self.movie_screens = []
                 for representative_id in info.representatives:
                     gen = representative_id // self.sim.creature_count
                     c = representative_id % self.sim.creature_count
-                    self.creature_highlight.append(self.sim.creatures[gen][c])
-                    self.visual_sim_memory.append(
-                        self.sim.simulate_import(gen, c, c + 1, True)
-                    )
+                    self.creature_highlight.append(self.sim.get_creature(gen, c))
+                    self.sim.movies.add(gen, c)
                     self.movie_screens.append(None)
                 self.draw_info_bar_species(self.clh[1])
             else:  # a creature was highlighted!
-                self.creature_highlight = [self.sim.creatures[gen][self.clh[1]]]
-                self.visual_sim_memory = [
-                    self.sim.simulate_import(gen, self.clh[1], self.clh[1] + 1, True)
-                ]
+                self.creature_highlight = [self.sim.get_creature(gen, self.clh[1])]
+                self.sim.movies.clear()
+                self.sim.movies.add(gen, self.clh[1])
                 self.movie_screens = [None] * 1
-                self.draw_info_bar_creature(self.sim.creatures[gen][self.clh[1]])
+                self.draw_info_bar_creature(self.creature_highlight[0])
 
     def clear_movies(self):
-        self.visual_sim_memory = []
+        self.sim.movies.clear()
         self.creature_highlight = []
         self.movie_screens = []
         self.clh = [None, None, None]
@@ -292,6 +307,8 @@ class UI:
         for level in range(len(ps)):
             for i in range(len(ps[level])):
                 s = ps[level][i]
+                if self.sim.species_info[s].coords is None:
+                    continue  # not drawn in the genealogy yet
                 sX, sY = self.sim.species_info[s].coords
                 if (
                     get_distance(mouse_x, mouse_y, sX, sY)
@@ -302,48 +319,70 @@ class UI:
 
     def draw_creature_mosaic(self, gen):
         self.mosaic_screen.fill(self.mosaic_color)
-        for c in range(self.sim.creature_count):
+        if self.style_button.setting == 2:
+            species_colors = get_species_colors(
+                self.sim.population.species[gen], self
+            ).tolist()
+        creatures = [
+            self.sim.get_creature(gen, c) for c in range(self.sim.creature_count)
+        ]
+        s = self.style_button.setting
+        mosaic_dimension = self.mosaic_dim[s]
+        spacing = self.mosaic_width_creatures / mosaic_dimension
+        for c, creature in enumerate(creatures):
             i = c
-            if self.sim.creatures[gen][c].rank is not None:
+            if creature.rank is not None:
                 if self.sort_button.setting == 1:
-                    i = self.sim.creatures[gen][c].rank
+                    i = creature.rank
                 elif self.sort_button.setting == 2:
-                    i = self.reverse(self.sim.creatures[gen][c].rank)
-            mosaic_dimension = self.mosaic_dim[self.style_button.setting]
+                    i = self.reverse(creature.rank)
             x = i % mosaic_dimension
             y = i // mosaic_dimension
-            creature = self.sim.creatures[gen][c]
-            spacing = self.mosaic_width_creatures / mosaic_dimension
-            creature.icon_coords = (
+            self.icon_coords[c] = (
                 x * spacing + self.cm_margin2,
                 y * spacing + self.cm_margin2,
                 spacing,
                 spacing,
             )
-            if creature.icon_coords[1] < self.mosaic_screen.get_height():
-                s = self.style_button.setting
-                if s <= 1:
-                    self.mosaic_screen.blit(creature.icons[s], creature.icon_coords)
-                elif s == 2:
-                    extra = 1
-                    pygame.draw.rect(
-                        self.mosaic_screen,
-                        species_to_color(creature.species, self),
-                        (
-                            creature.icon_coords[0],
-                            creature.icon_coords[1],
-                            spacing + extra,
-                            spacing + extra,
-                        ),
-                    )
-                if not creature.living and self.show_xs:
-                    color = (255, 0, 0) if s <= 1 else (0, 0, 0)
-                    draw_x(
-                        creature.icon_coords,
-                        self.icon_dimension[s][0],
-                        color,
-                        self.mosaic_screen,
-                    )
+
+        # the icons of every creature on screen, with any misses drawn together
+        visible = [
+            c
+            for c in range(self.sim.creature_count)
+            if self.icon_coords[c][1] < self.mosaic_screen.get_height()
+        ]
+        if s <= 1:
+            icons = self.icon_cache.get_icons(
+                [creatures[c] for c in visible],
+                self.icon_dimension[s],
+                self.mosaic_color,
+                self.sim.beat_fade_time,
+            )
+        for j, c in enumerate(visible):
+            creature = creatures[c]
+            icon_coords = self.icon_coords[c]
+            if s <= 1:
+                self.mosaic_screen.blit(icons[j], icon_coords)
+            elif s == 2:
+                extra = 1
+                pygame.draw.rect(
+                    self.mosaic_screen,
+                    species_colors[c],
+                    (
+                        icon_coords[0],
+                        icon_coords[1],
+                        spacing + extra,
+                        spacing + extra,
+                    ),
+                )
+            if not creature.living and self.show_xs:
+                color = (255, 0, 0) if s <= 1 else (0, 0, 0)
+                draw_x(
+                    icon_coords,
+                    self.icon_dimension[s][0],
+                    color,
+                    self.mosaic_screen,
+                )
 
     def draw_info_bar_creature(self, creature):
         x_center = int(self.info_width * 0.5)
@@ -428,8 +467,8 @@ class UI:
         now = min(self.generation_slider.val, len(self.sim.species_pops) - 1)
         now_pop = 0
         extinct_string = " (Extinct)"
-        if species in self.sim.species_pops[now]:
-            now_pop = self.sim.species_pops[now][species][0]
+        now_pop = self.sim.species_pops.get_population(now, species)
+        if now_pop > 0:
             extinct_string = ""
         strings = [
             f"Species {s_name}",
@@ -469,13 +508,14 @@ class UI:
     def draw_lightboard(self, screen, species, gen, coords):
         DIM = self.mosaic_dim[-1]
         R = coords[2] / DIM
+        color = species_to_color(species, self)
+        ranked_species = self.sim.population.species[gen, self.sim.rankings[gen]]
         for c in range(self.sim.creature_count):
             x = coords[0] + R * (c % DIM)
             y = coords[1] + R * (c // DIM)
             col = (0, 0, 0)
-            creature = self.sim.creatures[gen][self.sim.rankings[gen][c]]
-            if creature.species == species:
-                col = species_to_color(species, self)
+            if ranked_species[c] == species:
+                col = color
             pygame.draw.rect(screen, col, (x, y, R, R))
 
     def draw_menu_text(self):
@@ -513,70 +553,100 @@ class UI:
     def draw_previews(self):
         gen = self.generation_slider.val
         if 0 <= gen < len(self.sim.rankings):
-            names = ["Best", "Median", "Worst"]
-            for r in range(3):
-                r_i = self.r_to_rank(r)
-                index = self.sim.rankings[gen][r_i]
-                creature = self.sim.creatures[gen][index]
-                dimensions = (
-                    self.preview_locations[r][2],
-                    self.preview_locations[r][3],
-                )
-                preview = creature.draw_icon(
-                    dimensions, self.mosaic_color, self.sim.beat_fade_time
-                )
-                display_centered_text(
-                    preview,
-                    f"{names[r]} creature",
-                    dimensions[0] / 2,
-                    dimensions[1] - 20,
-                    self.white,
-                    self.small_font,
-                )
-                align_text(
-                    preview,
-                    dist_to_text(creature.fitness, True, self.sim.units_per_meter),
-                    10,
-                    20,
-                    self.white,
-                    self.small_font,
-                    0.0,
-                    None,
-                )
+            # rendered again only when the generation or the species colors
+            # change, not on every frame
+            preview_key = (
+                gen,
+                self.salt,
+                tuple(sorted(self.overridden_colors.items())),
+            )
+            if preview_key != self.preview_key:
+                self.previews = self.render_previews(gen)
+                self.preview_key = preview_key
+            for r, preview in enumerate(self.previews):
                 self.screen.blit(
                     preview,
                     (self.preview_locations[r][0], self.preview_locations[r][1]),
                 )
 
+    def render_previews(self, gen):
+        previews = []
+        names = ["Best", "Median", "Worst"]
+        for r in range(3):
+            r_i = self.r_to_rank(r)
+            index = self.sim.rankings[gen][r_i]
+            creature = self.sim.get_creature(gen, index)
+            dimensions = (
+                self.preview_locations[r][2],
+                self.preview_locations[r][3],
+            )
+            preview = creature.draw_icon(
+                dimensions, self.mosaic_color, self.sim.beat_fade_time
+            )
+            display_centered_text(
+                preview,
+                f"{names[r]} creature",
+                dimensions[0] / 2,
+                dimensions[1] - 20,
+                self.white,
+                self.small_font,
+            )
+            align_text(
+                preview,
+                dist_to_text(creature.fitness, True, self.sim.units_per_meter),
+                10,
+                20,
+                self.white,
+                self.small_font,
+                0.0,
+                None,
+            )
+            previews.append(preview)
+        return previews
+
     def do_movies(self):
-        L = len(self.visual_sim_memory)
+        L = len(self.sim.movies)
         movie_screen_scale = [1, 1, 0.5, 0.70]
         if self.sample_button.setting == 1:
             self.sample_frames += 1
             if self.sample_frames >= self.sim.trial_time + self.sample_freeze_time:
                 self.start_sample_helper()
+        # every playing movie is stepped in one batch
+        self.sim.movies.advance()
+        frames = []
+        transforms = []
         for i in range(L):
-            if self.visual_sim_memory[i][2] < self.sim.trial_time:
-                self.visual_sim_memory[i] = self.sim.simulate_run(
-                    self.visual_sim_memory[i], 1, False
-                )
             DIM = array_int_multiply(
                 self.movie_single_dimension, movie_screen_scale[self.clh[0]]
             )
             self.movie_screens[i] = pygame.Surface(DIM, pygame.SRCALPHA, 32)
 
-            node_array, _, current_frame = self.visual_sim_memory[i]
+            frames.append(self.sim.movies.get_frame(i))
+            node_array = frames[i][0]
             s = DIM[0] / (self.sim.creature_width + 2) * 0.5  # visual transform scale
 
             average_x = np.mean(node_array[:, :, :, 0])
-            transform = [DIM[0] / 2 - average_x * s, DIM[1] * 0.8, s]
+            transforms.append([DIM[0] / 2 - average_x * s, DIM[1] * 0.8, s])
+        if L == 0:
+            return
+        # and every playing movie's cells are rasterized in one batch
+        cell_layers = get_cell_layers(
+            self.creature_highlight[:L],
+            [screen.get_size() for screen in self.movie_screens[:L]],
+            [node_array[0] for node_array, _ in frames],
+            [current_frame for _, current_frame in frames],
+            transforms,
+        )
+        for i in range(L):
+            node_array, current_frame = frames[i]
             self.creature_highlight[i].draw_creature(
                 self.movie_screens[i],
                 node_array[0],
                 current_frame,
-                transform,
+                transforms[i],
                 True,
                 (i == 0),
+                cell_layers[i],
             )
 
     def get_highlighted_species(self):
@@ -584,7 +654,7 @@ class UI:
         if self.clh[0] == 2:
             return self.clh[1]
         if self.clh[0] == 0 or self.clh[0] == 1:
-            return self.sim.creatures[gen][self.clh[1]].species
+            return self.sim.get_creature(gen, self.clh[1]).species
         return None
 
     def detect_events(self):
@@ -614,11 +684,12 @@ class UI:
                     c = self.get_highlighted_species()
                     if c is not None:
                         self.overridden_colors[c] = str(random.uniform(0, 1))
+                        clear_species_caches()
                         draw_all_graphs(self.sim, self)
                         self.clear_movies()
                         self.detect_mouse_motion()
                 elif event.key == 13:  # pressing Enter
-                    self.sim.simulate_generation(None)
+                    self.sim.request_generation(None)
                 elif event.key == 113:  # pressing 'Q'
                     self.show_creatures_button.last_click_time = time.monotonic()
                     self.show_creatures_button.setting = (
@@ -705,7 +776,7 @@ class UI:
                 (dimensions[0], dimensions[1]),
             )
         else:
-            coords = self.sim.creatures[gen][self.clh[1]].icon_coords
+            coords = self.icon_coords[self.clh[1]]
             x = coords[0] + self.cm_margin1
             y = coords[1] + self.cm_margin1
             self.screen.blit(draw_ring_light(coords[2], coords[3], 6), (x, y))
@@ -753,15 +824,15 @@ class UI:
     def start_sample_helper(self):
         num_samples = 8
         self.creature_highlight = []
-        self.visual_sim_memory = []
+        self.sim.movies.clear()
         self.movie_screens = []
         self.clh = [3, 0]
         self.sample_frames = 0
         for sample_idx in range(num_samples):
             gen = self.generation_slider.val
             c = (self.sample_i + sample_idx) % self.sim.creature_count
-            self.creature_highlight.append(self.sim.creatures[gen][c])
-            self.visual_sim_memory.append(self.sim.simulate_import(gen, c, c + 1, True))
+            self.creature_highlight.append(self.sim.get_creature(gen, c))
+            self.sim.movies.add(gen, c)
             self.movie_screens.append(None)
         self.sample_i += num_samples
 
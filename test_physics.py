@@ -0,0 +1,67 @@
+import numpy as np
+
+from jes_physics import (
+    PhysicsEngine,
+    measure_step_allocations,
+    set_grid_node_coords,
+    set_muscles,
+)
+
+WIDTH, HEIGHT, BEATS = 4, 4, 3
+
+
+def make_engine():
+    return PhysicsEngine(
+        creature_dimensions=[WIDTH, HEIGHT],
+        beat_time=20,
+        beats_per_cycle=BEATS,
+        y_clips=[-10000000, 0],
+        ground_friction_coef=25,
+        gravity_acceleration_coef=0.002,
+        calming_friction_coef=0.7,
+        typical_friction_coef=0.8,
+        muscle_coef=0.08,
+    )
+
+
+def make_batch(count, seed=0):
+    rng = np.random.default_rng(seed)
+    dna = rng.normal(0, 1, (count, WIDTH * HEIGHT * BEATS * 3 + 1))
+    muscles = np.zeros((count, HEIGHT, WIDTH, BEATS, 4))
+    set_muscles(muscles, dna, 3)
+    node_coords = np.zeros((count, HEIGHT + 1, WIDTH + 1, 4))
+    set_grid_node_coords(node_coords)
+    return node_coords, muscles
+
+
+def test_degenerate_creature_leaves_others_alone():
+    node_coords, muscles = make_batch(6)
+    expected = node_coords.copy()
+    make_engine().run(expected, muscles, 0, 300, False)
+
+    # a creature with a zero-length spring: its nodes all sit on one spot,
+    # so its spring directions are 0 / 0
+    broken = node_coords.copy()
+    broken[2, :, :, :2] = 0
+    with np.errstate(invalid="ignore"):
+        make_engine().run(broken, muscles, 0, 300, False)
+
+    others = [0, 1, 3, 4, 5]
+    assert np.isfinite(expected).all()
+    assert np.array_equal(broken[others], expected[others])
+
+
+def test_steps_allocate_nothing_per_creature():
+    for calming_run in (False, True):
+        peaks = {}
+        for count in (40, 400):
+            engine = make_engine()
+            node_coords, muscles = make_batch(count)
+            engine.bind(count, muscles)
+            engine.load(node_coords)
+            # the first steps in a process also fill NumPy's one-off caches
+            measure_step_allocations(engine, 0, calming_run)
+            retained, peaks[count] = measure_step_allocations(engine, 0, calming_run)
+            assert retained == 0
+        # a temporary of one float per node would be 115 kB at 400 creatures
+        assert peaks[400] - peaks[40] < 1024
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from jes import create_simulation
+from jes_checkpoint import get_checkpoint_arrays, read_checkpoint
+
+
+def run_simulation(generations, **kwargs):
+    sim = create_simulation(20, seed=1, **kwargs)
+    sim.initialize_universe()
+    for _ in range(generations):
+        sim.simulate_generation(None)
+    sim.close()
+    return sim
+
+
+def assert_same_run(sim, other):
+    arrays = get_checkpoint_arrays(sim)
+    other_arrays = get_checkpoint_arrays(other)
+    assert arrays.keys() == other_arrays.keys()
+    for name, array in arrays.items():
+        # the newest generation's fitness isn't known yet, so it is NaN
+        assert np.array_equal(
+            array, other_arrays[name], equal_nan=name == "population_fitness"
+        ), name
+
+
+def test_odd_creature_count_is_rejected():
+    # the middle creature of an odd population would have no pair to breed in
+    with pytest.raises(ValueError):
+        create_simulation(41)
+
+
+def test_sharded_run_matches_serial_run():
+    assert_same_run(run_simulation(3), run_simulation(3, worker_count=2))
+
+
+def test_fitness_cache_doesnt_change_the_run():
+    sim = run_simulation(4)
+    assert sim.fitness_cache.hits > 0
+    assert_same_run(sim, run_simulation(4, fitness_cache_size=0))
+
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path):
+    path = str(tmp_path / "run.npz")
+    # saved every other generation, so the checkpoint is stitched together
+    # from several chunks
+    run_simulation(5, checkpoint_path=path, checkpoint_every=2)
+    sim = create_simulation(20)
+    sim.resume_universe(read_checkpoint(path))
+    for _ in range(2):
+        sim.simulate_generation(None)
+    sim.close()
+    assert_same_run(sim, run_simulation(7))
@@ -4,14 +4,6 @@ from hashlib import sha256
 import numpy as np
 
 
-def array_lerp(arrA, arrB, x):
-    return arrA + (arrB - arrA) * x
-
-
-def list_lerp(listA, listB, x):
-    return [a + (b - a) * x for a, b in zip(listA, listB)]
-
-
 def getUnit(r):
     _list = [
         0.000001,
@@ -76,8 +68,28 @@ def hue_to_rgb(hue):
     return (255 * r[0], 200 * r[1], 255 * r[2])
 
 
+# Species names and colors are hashed from the species (or its overridden
+# color) and the UI's salt, and looked up for every species drawn in every
+# frame, so they are memoized on exactly those inputs.
+species_name_cache = {}
+species_color_cache = {}
+
+
+def clear_species_caches():
+    species_name_cache.clear()
+    species_color_cache.clear()
+
+
 def species_to_name(s, ui):
-    salted = str(s) + ui.salt
+    key = (s, ui.salt)
+    name = species_name_cache.get(key)
+    if name is None:
+        name = species_name_cache[key] = get_species_name(s, ui.salt)
+    return name
+
+
+def get_species_name(s, salt):
+    salted = str(s) + salt
     _hex = sha256(salted.encode("utf-8")).hexdigest()
     result = int(_hex, 16)
     length_choices = [5, 5, 6, 6, 7]
@@ -114,7 +126,24 @@ def brighten(color, brightness):
 
 def species_to_color(s, ui):
     override_color = ui.overridden_colors.get(s, str(s))
-    salted = override_color + ui.salt
+    key = (s, ui.salt, override_color)
+    color = species_color_cache.get(key)
+    if color is None:
+        color = species_color_cache[key] = get_species_color(override_color, ui.salt)
+    return color
+
+
+def get_species_colors(species, ui):
+    # one color per entry of an array of species, as an (n, 3) array
+    unique_species, inverse = np.unique(species, return_inverse=True)
+    table = np.array(
+        [species_to_color(s, ui) for s in unique_species.tolist()], dtype=np.float64
+    ).reshape((-1, 3))
+    return table[inverse.reshape(np.shape(species))]
+
+
+def get_species_color(override_color, salt):
+    salted = override_color + salt
     hex_digest = sha256(salted.encode("utf-8")).hexdigest()
     hue = (int(hex_digest, 16) % 10000) / 10000
     brightness = (math.floor(int(hex_digest, 16) // 10000) % 100) / 100
@@ -136,94 +165,6 @@ def dist_to_text(dist, sigfigs, u):
     return str(int(dist / u)) + "cm"
 
 
-def get_distance_array(a, b):
-    x_dist = a[:, :, :, 0] - b[:, :, :, 0]
-    y_dist = a[:, :, :, 1] - b[:, :, :, 1]
-    return np.sqrt(np.square(x_dist) + np.square(y_dist))
-
-
-def apply_muscles(n, m, muscle_spring_constant):
-    x_neighbor_distances = get_distance_array(n[:, :-1, :], n[:, 1:, :])
-    y_neighbour_distances = get_distance_array(n[:, :, :-1], n[:, :, 1:])
-    positive_diagonal_neighbor_distances = get_distance_array(
-        n[:, :-1, :-1], n[:, 1:, 1:]
-    )
-    negative_diagonal_neighbor_distances = get_distance_array(
-        n[:, :-1, 1:], n[:, 1:, :-1]
-    )
-
-    muscle_attractions = [None] * 6
-    segments = [
-        [0, 0, 1, 0],
-        [0, 1, 1, 1],
-        [0, 0, 0, 1],
-        [1, 0, 1, 1],
-        [0, 0, 1, 1],
-        [0, 1, 1, 0],
-    ]
-
-    muscle_attractions = [
-        get_muscle_attraction(
-            x_neighbor_distances[:, :, :-1], m[:, :, :, 0], muscle_spring_constant
-        ),
-        get_muscle_attraction(
-            x_neighbor_distances[:, :, 1:], m[:, :, :, 0], muscle_spring_constant
-        ),
-        get_muscle_attraction(
-            y_neighbour_distances[:, :-1, :], m[:, :, :, 1], muscle_spring_constant
-        ),
-        get_muscle_attraction(
-            y_neighbour_distances[:, 1:, :], m[:, :, :, 1], muscle_spring_constant
-        ),
-        get_muscle_attraction(
-            positive_diagonal_neighbor_distances, m[:, :, :, 3], muscle_spring_constant
-        ),
-        get_muscle_attraction(
-            negative_diagonal_neighbor_distances, m[:, :, :, 3], muscle_spring_constant
-        ),
-    ]
-
-    # The array n is a 100 x 5 x 5 x 4 dimensional array,
-    # and it encodes the position and velocity data for all 100 creatures on a frame.
-
-    # Dimension 1: 100 creatures (creature ID)
-    # Dimension 2: 5 nodes across the x-dimension
-    # Dimension 3: 5 nodes across the y-dimension
-    # Dimension 4: Which coordinate to do you want (x, y, vx, vy)
-    _, creature_width, creature_height, _ = n.shape
-    creature_width -= 1
-    creature_height -= 1
-
-    for direction in range(6):
-        s = segments[direction]
-        sli1 = n[:, s[0] : s[0] + creature_width, s[1] : s[1] + creature_width]
-        sli2 = n[:, s[2] : s[2] + creature_height, s[3] : s[3] + creature_height]
-
-        delta_x = sli1[:, :, :, 0] - sli2[:, :, :, 0]
-        delta_y = sli1[:, :, :, 1] - sli2[:, :, :, 1]
-
-        delta_magnitude = np.sqrt(np.square(delta_x) + np.square(delta_y))
-        delta_nx = delta_x / delta_magnitude
-        delta_ny = delta_y / delta_magnitude
-
-        n[:, s[0] : s[0] + creature_width, s[1] : s[1] + creature_width, 2] += (
-            delta_nx * muscle_attractions[direction]
-        )
-        n[:, s[0] : s[0] + creature_width, s[1] : s[1] + creature_width, 3] += (
-            delta_ny * muscle_attractions[direction]
-        )
-        n[:, s[2] : s[2] + creature_height, s[3] : s[3] + creature_height, 2] -= (
-            delta_nx * muscle_attractions[direction]
-        )
-        n[:, s[2] : s[2] + creature_height, s[3] : s[3] + creature_height, 3] -= (
-            delta_ny * muscle_attractions[direction]
-        )
-
-
-def get_muscle_attraction(dists, m, muscle_spring_constant):
-    return (m - dists) * muscle_spring_constant
-
-
 def get_distance(x1, y1, x2, y2):
     return np.linalg.norm(np.array([x2 - x1, y2 - y1]))
 